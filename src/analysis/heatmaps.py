@@ -4,19 +4,16 @@ import matplotlib.pyplot as plt
 from matplotlib.colors import Normalize
 from matplotlib.animation import FuncAnimation
 import numpy as np
-import pandas
 
+import trackformat
 
-def read_data(paths):
-    ''' Read all data from the files specified by the given list of paths.
-        Returns a list of dataframes, one per file.
+
+def read_data(paths, start_time=None, end_time=None):
+    ''' Read all data from the track files (CSV or binary) specified by the
+        given list of paths, or just the data from start_time to end_time
+        (in seconds).  Returns a list of dataframes, one per file.
     '''
-    colnames = ['time', 'status', 'x', 'y', 'numpts', '_1', '_2']
-    data = []
-    for path in paths:
-        df = pandas.read_csv(path, header=None, names=colnames, index_col=0)
-        data.append(df)
-    return data
+    return [trackformat.read_dataframe(path, start_time, end_time) for path in paths]
 
 
 def get_timeslice(dataframes, start_time, end_time):
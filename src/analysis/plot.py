@@ -7,8 +7,6 @@ from matplotlib import collections, lines, patches
 
 from analysis import heatmaps
 
-import config
-
 
 # Source: https://gist.github.com/jasonmc/1160951
 def _set_foregroundcolor(ax, color):
@@ -110,8 +108,9 @@ def savefig(outfile, format=None):
 
 class TrackPlotter(object):
     def __init__(self, track_processor, dbgframes=None):
+        '''dbgframes: list of (frame number, url) tuples for debug frames to link in trace plots'''
         self._track = track_processor
-        self._dbgframes = dbgframes
+        self._dbgframes = dbgframes or []
 
     @staticmethod
     def _speed2color(speed):
@@ -134,7 +133,8 @@ class TrackPlotter(object):
 
     def plot_trace(self):
         # one minute per subplot
-        numplots = self._track.len_minutes
+        first_minute = self._track.first_minute
+        numplots = self._track.len_minutes - first_minute
         fig = plt.figure(figsize=(12,2*(numplots+1)))
 
         # Draw the legend at the top
@@ -142,7 +142,7 @@ class TrackPlotter(object):
 
         for i in range(numplots):
             ax = plt.subplot(numplots+1, 1, i+2)
-            self._plot_trace_portion(ax, start_min=i, end_min=i+1)
+            self._plot_trace_portion(ax, start_min=first_minute+i, end_min=first_minute+i+1)
 
         return fig
 
@@ -184,7 +184,8 @@ class TrackPlotter(object):
     def plot_heatmap(self, plot_type='overall'):
         assert plot_type in ('per-minute', 'per-phase', 'overall')
         if plot_type == 'per-minute':
-            numplots = self._track.len_minutes
+            first_minute = self._track.first_minute
+            numplots = self._track.len_minutes - first_minute
         elif plot_type == 'per-phase':
             numplots = self._track.num_phases()
             phase_starts = self._track.phase_starts()
@@ -200,8 +201,8 @@ class TrackPlotter(object):
 
         for i in range(numplots):
             if plot_type == 'per-minute':
-                start_min = i
-                end_min = i+1
+                start_min = first_minute+i
+                end_min = first_minute+i+1
                 title = "{}:00-{}:00".format(start_min, end_min)
             elif plot_type == 'per-phase':
                 start_min = phase_starts[i]
@@ -307,17 +308,13 @@ class TrackPlotter(object):
 #        )
 
         # Add markers/links to debugframes if given
-        # Get [tracking]:start_frame for proper offset of debug frame numbers into track data here
-        start_frame = int(self._track.config['tracking']['start_frame'])
-        for dbgframe in self._dbgframes:
-            nameparts = dbgframe.name.split('_')
-            frameindex = max(0, int(nameparts[1]) - start_frame)  # restrict to index 0 at minimum
-            frametime = self._track.df.index[frameindex]
-            if start <= frametime < end:
+        for frame_num, url in self._dbgframes:
+            frametime = self._track.frame_time(frame_num)
+            if frametime is not None and start <= frametime < end:
                 marker = matplotlib.patches.Circle(
                     (frametime, -1.1), radius=0.08,
                     color='#337AB7',
                     clip_on=False,
-                    url=str("/data" / dbgframe.relative_to(config.DATADIR))
+                    url=url
                 )
                 ax.add_artist(marker)
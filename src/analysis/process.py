@@ -2,9 +2,10 @@ import configparser
 import itertools
 import math
 import numpy as np
-import pandas
 
 from common import Phase  # noqa
+import trackformat
+import trigger
 
 _entry_wait = 2  # min seconds between counted entries to top
 _freeze_min_time = 2  # min seconds to count lack of motion as a "freeze"
@@ -33,8 +34,32 @@ def groups_where(vals):
     return starts, lens
 
 
+def read_setup(setupfile):
+    ''' Read a track's -setup.txt file.  Returns (config, phase_list): a
+        ConfigParser and a list of Phases.
+    '''
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(setupfile)
+    # parse phases_data
+    if 'phases' in config and 'phases_data' in config['phases']:
+        phases_data_str = config['phases']['phases_data']
+        phase_list = eval(phases_data_str)  # uses Phase namedtuple imported from common
+    elif 'experiment_args' in config:
+        # older setup file; look for experiment_args section and build a Phase from that
+        onephase = Phase(
+            phasenum=1,
+            length=int(config['experiment_args']['time']),
+            dostim=(config['at_runtime']['dostim'] == 'True'),
+            background=None
+        )
+        phase_list = [onephase]
+    else:
+        phase_list = []  # no clue...
+    return config, phase_list
+
+
 class TrackProcessor(object):
-    def __init__(self, trackfile, just_raw_data=False, normalize_x_with_trigger=None):
+    def __init__(self, trackfile, just_raw_data=False, normalize_x_with_trigger=None, minutes=None, phase=None):
         '''
             Params:
               trackfile:  String containing a path to the trackfile to be processed.
@@ -43,13 +68,26 @@ class TrackProcessor(object):
               normalize_x_with_trigger:  String.  If set, 'normalized' versions of x coordinates
                                          and related columsn will be generated (normx = 1-x)
                                          if the trigger condition of the given track matches this value.
+              minutes:  Tuple of (start_min, end_min).  If set, only that part of the track is
+                        processed, and only those rows are read if the track has an index.
+              phase:  Integer phase number.  If set, only that phase is processed: the rows
+                      recorded in it, if the track's index has it, or else the rows in its
+                      scheduled minutes (which become self.minutes).
         '''
         self.trackfile = trackfile
-        self.setupfile = trackfile.replace("-track.csv", "-setup.txt")
+        self.minutes = minutes
+        self.phase = phase
+        self.setupfile = trackformat.strip_suffix(trackfile) + "-setup.txt"
+        self._normalize_x_with_trigger = normalize_x_with_trigger
 
         # creates self.config, self.phase_list
         self._read_setupfile()
 
+        if phase is not None:
+            starts = self.phase_starts()
+            i = [p.phasenum for p in self.phase_list].index(phase)
+            self.minutes = (starts[i], starts[i+1])
+
         # creates self.df
         self._read_trackfile()
 
@@ -60,27 +98,26 @@ class TrackProcessor(object):
             else:
                 self.df['norm_x'] = self.df.x
 
-        if not just_raw_data:
+        # (nothing to process if a range of minutes holds no data)
+        if not just_raw_data and not self.df.empty:
             self._generate_columns()
 
     def _read_trackfile(self):
-        colnames = ['time', 'status', 'x', 'y', 'numpts', '_1', '_2']
-        # for handling data w/ '.' in place of unknown initial locations
-
-        def xy_to_float(s):
-            if s == '.':
-                return -1
-            else:
-                return float(s)
-
-        self.df = pandas.read_csv(
-            self.trackfile, header=None, names=colnames, index_col=0,
-            converters={2: xy_to_float, 3: xy_to_float}
-        )
+        # CSV or binary; unknown initial locations are given as -1
+        # (self.first_row: the row of the whole track that self.df starts at)
+        if self.phase is not None:
+            start_min, end_min = self.minutes
+            self.df, self.first_row = trackformat.read_phase(self.trackfile, self.phase, start_min*60, end_min*60, return_first_row=True)
+        elif self.minutes is not None:
+            start_min, end_min = self.minutes
+            self.df, self.first_row = trackformat.read_dataframe(self.trackfile, start=start_min*60, end=end_min*60, return_first_row=True)
+        else:
+            self.df = trackformat.read_dataframe(self.trackfile)
+            self.first_row = 0
 
     def _generate_columns(self):
         ''' Calculate several auxiliary columns from the raw data
-            read from CSV by _read_trackfile().
+            read from the track file by _read_trackfile().
         '''
         # shorthand
         df = self.df
@@ -112,37 +149,21 @@ class TrackProcessor(object):
         df['valid'] = ~df.lost & ~df.missing & ~np.roll(df.lost, 1) & ~np.roll(df.missing, 1)
 
         trigger_exp = self.config['experiment']['trigger']
-        # create xpos/ypos aliases for trigger_exp to use
-        xpos = df.x  # noqa (it is used, but in an eval)
-        ypos = df.y  # noqa
-        df['trigger'] = df.valid & eval(trigger_exp)
+        # zones, as used by the box (see trigger.py)
+        zones = self.config['zones'] if 'zones' in self.config else None
+        df['trigger'] = df.valid & trigger.TriggerGrid(trigger_exp, zones).test_many(df.x, df.y)
         if '.5' in trigger_exp:
             # create columns for "more triggered" conditions if trigger is of form > or < 0.50
             trigger_dir_gt = '>' in trigger_exp
             trigger_plus_vals = [.6, .7, .8, .9] if trigger_dir_gt else [.4, .3, .2, .1]
             for i, newval in enumerate(trigger_plus_vals):
-                df['trigger_plus{}'.format(i + 1)] = df.valid & eval(trigger_exp.replace('.5', str(newval)))
+                grid = trigger.TriggerGrid(trigger_exp.replace('.5', str(newval)), zones)
+                df['trigger_plus{}'.format(i + 1)] = df.valid & grid.test_many(df.x, df.y)
 
         df['frozen'] = df.valid & (df.speed.rolling(window=_freeze_window_size, center=True).max() < _freeze_max_speed)
 
     def _read_setupfile(self):
-        self.config = configparser.ConfigParser(interpolation=None)
-        self.config.read(self.setupfile)
-        # parse phases_data
-        if 'phases' in self.config and 'phases_data' in self.config['phases']:
-            phases_data_str = self.config['phases']['phases_data']
-            self.phase_list = eval(phases_data_str)  # uses Phase namedtuple imported from common
-        elif 'experiment_args' in self.config:
-            # older setup file; look for experiment_args section and build a Phase from that
-            onephase = Phase(
-                phasenum=1,
-                length=int(self.config['experiment_args']['time']),
-                dostim=(self.config['at_runtime']['dostim'] == 'True'),
-                background=None
-            )
-            self.phase_list = [onephase]
-        else:
-            self.phase_list = []  # no clue...
+        self.config, self.phase_list = read_setup(self.setupfile)
 
     def num_phases(self):
         return len(self.phase_list)
@@ -163,8 +184,26 @@ class TrackProcessor(object):
 
         return ret
 
+    def frame_time(self, frame_num):
+        '''Return the time in the track of the given frame (numbered from 1,
+        as in debug frames), taken from its row, or None if the frame has no
+        row among those read (it came before tracking started, or lies
+        outside the minutes or phase read).  The box writes a row for every
+        frame from [tracking] start_frame on.'''
+        start_frame = self.config.getint('tracking', 'start_frame', fallback=1)
+        row = frame_num - start_frame - self.first_row
+        if 0 <= row < len(self.df):
+            return self.df.index[row]
+        return None
+
+    @property
+    def first_minute(self):
+        return self.minutes[0] if self.minutes is not None else 0
+
     @property
     def len_minutes(self):
+        if self.minutes is not None:
+            return self.minutes[1]
         # Take second-to-last index so if just *one* sample in the new minute
         # (e.g. time=3600.0456), it still just counts as 60 minutes
         return int(math.ceil(self.df.index[-2] / 60.0))
@@ -191,11 +230,21 @@ class TrackProcessor(object):
         ret['all'] = self._get_stats_time_range(minutes='all')
         # only include per-phase stats if we have more than one phase
         if include_phases and self.phase_list is not None and len(self.phase_list) > 1:
+            # for a track with an index, read each phase on its own: just the
+            # rows recorded in it, wherever its boundaries actually fell;
+            # otherwise, take each phase's scheduled minutes of self.df
+            indexed = trackformat.read_index(self.trackfile) is not None
             start_min = 0
             for phase in self.phase_list:
-                phase_stats = self._get_stats_time_range(
-                                minutes=(start_min, start_min+phase.length)
-                              )
+                if indexed:
+                    phase_processor = TrackProcessor(self.trackfile,
+                                                     normalize_x_with_trigger=self._normalize_x_with_trigger,
+                                                     phase=phase.phasenum)
+                    phase_stats = phase_processor._get_stats_time_range(minutes='all')
+                else:
+                    phase_stats = self._get_stats_time_range(
+                                    minutes=(start_min, start_min+phase.length)
+                                  )
                 ret['phase %d' % phase.phasenum] = phase_stats
                 start_min += phase.length
         return ret
@@ -274,7 +323,7 @@ class TrackProcessor(object):
             df = df[selected]
 
         total_count = len(df)
-        total_time = df.dt.sum()
+        total_time = df.dt.sum() if total_count else 0  # (no columns generated if no data)
 
         stats["#Datapoints"] = total_count
         stats["Total time (sec)"] = total_time
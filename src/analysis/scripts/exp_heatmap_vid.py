@@ -2,10 +2,12 @@
 
 import configparser
 import glob
+import os
 import matplotlib.pyplot as plt
 
 from collections import defaultdict
 
+import trackformat
 from .. import heatmaps
 
 
@@ -38,7 +40,9 @@ def run(args):
         else:
             key += "-left"
 
-        trackfile = setupfile.replace('-setup.txt', '-track.csv')
+        trackfile = setupfile.replace('-setup.txt', trackformat.CSV_SUFFIX)
+        if not os.path.exists(trackfile):
+            trackfile = setupfile.replace('-setup.txt', trackformat.BIN_SUFFIX)
 
         tracks[key].append(trackfile)
 
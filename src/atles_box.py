@@ -17,6 +17,7 @@ import threading
 import time
 
 import config
+import trackformat
 from common import Phase, get_boxname, mkdir
 from box import experiment
 
@@ -103,6 +104,10 @@ def get_args():
                         help='create a window to see the camera view and tracking information')
     parser.add_argument('--debug-frames', type=int, default=100, metavar='N',
                         help='save an image of the current frame every N frames - also saves a frame any time tracking is lost (default: 100; 0 means no debug frames will be written, including tracking-lost frames)')
+    parser.add_argument('--loss-clips', type=float, default=0, metavar='S', dest='loss_clip_before',
+                        help='keep the last S seconds of video in memory, and save them with the following --loss-clip-after seconds as a clip whenever tracking is lost, in place of a single debug frame (default: 0 = no clips)')
+    parser.add_argument('--loss-clip-after', type=float, default=2, metavar='S',
+                        help='with --loss-clips, seconds of video after the loss of tracking to include in each clip (default: 2)')
     parser.add_argument('--notes', type=str,
                         help='additional notes to be saved alongside the experiment data (optional)')
 
@@ -145,7 +150,7 @@ def get_args():
 
 def init_logging(args, conf):
     '''Initialize the logging system.  Uses argdir and id from args, adds 'trackfile' to conf
-       as a file object to which track data should be written.'''
+       as a track writer (see trackformat.py) to which track data should be written.'''
 
     # setup log files
     filetimestamp = time.strftime("%Y%m%d-%H%M%S")
@@ -164,7 +169,6 @@ def init_logging(args, conf):
     os.umask(oldmask)
     conf['debugframe_dir'] = debugframe_dir
 
-    trackfilename = "%s/%s-track.csv" % (config.TRACKDIR, name)
     logfilename = "%s/%s.log" % (config.TRACKDIR, name)
 
     # Setup the ROOT level logger to send to a log file and console both
@@ -181,10 +185,15 @@ def init_logging(args, conf):
 
     logging.info("Logging started.")
 
-    conf['trackfile'] = open(trackfilename, 'w')
+    track_format = conf['tracking'].get('track_format', 'csv')
+    conf['trackfile'] = trackformat.open_writer("%s/%s" % (config.TRACKDIR, name), track_format)
+    conf['timingfile'] = config.TIMINGFILE
+    conf['latencyfile'] = "%s/%s-stimlatency.csv" % (config.TRACKDIR, name)
+    conf['sensorfile'] = "%s/%s-sensors.csv" % (config.TRACKDIR, name)
+    conf['eventsfile'] = "%s/%s-events.csv" % (config.TRACKDIR, name)
 
 
-def write_setup(conf):
+def write_setup(conf, trackdir=config.TRACKDIR):
     # Record the setup in a -setup.txt file.
 
     parser = RawConfigParser(dict_type=OrderedDict)
@@ -194,10 +203,12 @@ def write_setup(conf):
             continue
 
         parser.add_section(section)
-        for key in sorted(conf[section]):
+        # zones may use the zones defined before them, so keep their order
+        keys = conf[section] if section == 'zones' else sorted(conf[section])
+        for key in keys:
             parser.set(section, key, conf[section][key])
 
-    setupfilename = "%s/%s-setup.txt" % (config.TRACKDIR, conf['name'])
+    setupfilename = "%s/%s-setup.txt" % (trackdir, conf['name'])
     with open(setupfilename, 'w') as setupfile:
         # TODO: move to python3 and use shlex.quote() instead
         cmdline = repr(' '.join(pipes.quote(s) for s in sys.argv))
@@ -284,6 +295,12 @@ def main():
         # However, infinity works.
         runthread.join(float("inf"))
 
+    # add the stimulus latency to the setup file
+    latency = exp.stimulus_latency()
+    if latency and latency['count']:
+        conf['stimulus_latency'] = {key if key == 'count' else "%s_ms" % key: round(value, 3) for key, value in latency.items()}
+        write_setup(conf)
+
     sys.exit(0)
 
 
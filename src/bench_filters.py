@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# bench_filters.py - Measure per-frame time and memory allocation of the
+#                    tracking frame filters, with and without buffer reuse,
+#                    and compare the background models selectable with
+#                    [tracking] bgsub (MOG2, running average, running median)
+#                    side by side: time per frame of the model's filter, and
+#                    tracking accuracy, measured against tracking with MOG2.
+#
+# e.g.:  ./bench_filters.py                 (all videos in tests/)
+#        ./bench_filters.py ../tests/testvid.mp4 --tolerance 3
+#
+
+import argparse
+import math
+import time
+import tracemalloc
+
+import cv2
+import numpy
+
+import config
+from box import tracking
+
+BGSUB_MODELS = ['mog2', 'average', 'median']
+
+
+def read_frames(vidfile, channel=1):
+    '''Read all frames of a video into memory (so decoding isn't measured),
+    each as a view of the given channel, like the frames Experiment gets.'''
+    video = cv2.VideoCapture(vidfile)
+    frames = []
+    while True:
+        rval, frame = video.read()
+        if not rval:
+            break
+        frames.append(frame[:, :, channel])
+    video.release()
+    return frames
+
+
+def make_filters(w, h, reuse_buffers, bgsub='mog2'):
+    '''Setup the same filters as Experiment, and a tracker to feed the distance filter.'''
+    track = tracking.VelocityTracker(w=w, h=h)
+    filt_bgsub = tracking.make_bgsub_filter({'bgsub': bgsub}, reuse_buffers=reuse_buffers)
+    filt_bright = tracking.TargetFilterBrightness(reuse_buffers=reuse_buffers)
+    filt_dist = tracking.TargetFilterDistance(track, maxdist=int(w*0.1), reuse_buffers=reuse_buffers)
+    framefilters = [filt_bgsub & filt_bright, filt_bgsub, filt_bright & filt_dist]
+    return track, framefilters, filt_bgsub
+
+
+def apply_filters(framefilters, frame):
+    # same as Experiment._apply_filters()
+    for filter in framefilters:
+        output = filter(frame)
+        if cv2.countNonZero(output):
+            return output
+    return output
+
+
+def run_filters(frames, reuse_buffers, trace_memory):
+    h, w = frames[0].shape
+    track, framefilters, _ = make_filters(w, h, reuse_buffers)
+    proc = tracking.FrameProcessor()
+    subframe = numpy.empty((h, w), numpy.uint8)
+
+    times = []
+    allocated = []
+    for frame in frames:
+        if trace_memory:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+
+        # as Experiment._extract_subframe() does
+        numpy.copyto(subframe, frame)
+        filtered = apply_filters(framefilters, subframe[:])
+
+        times.append(time.perf_counter() - start)
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - before)
+
+        # track, so the distance filter has a position to work with
+        proc.new_frame(filtered)
+        track.update(proc.centroids)
+
+    return times, allocated
+
+
+def track_with_model(frames, bgsub):
+    '''Track the frames using the given background model.  Returns the time
+    taken by the background subtraction filter for each frame, and the
+    tracked position (in pixels) in each frame, or None where the fish was
+    not acquired.'''
+    h, w = frames[0].shape
+    track, framefilters, filt_bgsub = make_filters(w, h, reuse_buffers=True, bgsub=bgsub)
+    proc = tracking.FrameProcessor()
+    subframe = numpy.empty((h, w), numpy.uint8)
+
+    times = []
+    positions = []
+    for frame in frames:
+        # as Experiment._extract_subframe() does
+        numpy.copyto(subframe, frame)
+        frame = subframe[:]
+        start = time.perf_counter()
+        filt_bgsub(frame)  # (cached, so not run again in apply_filters())
+        times.append(time.perf_counter() - start)
+
+        filtered = apply_filters(framefilters, frame)
+        proc.new_frame(filtered)
+        track.update(proc.centroids)
+        positions.append(track.position_pixel if track.status == 'acquired' else None)
+
+    return times, positions
+
+
+def compare_models(frames, repeat, tolerance):
+    '''Print the time per frame and tracking accuracy of each background
+    model, with MOG2's track as the reference.'''
+    results = {}
+    for bgsub in BGSUB_MODELS:
+        times = []
+        for _ in range(repeat):
+            pass_times, positions = track_with_model(frames, bgsub)
+            times.extend(pass_times)
+        results[bgsub] = times, positions
+
+    reference = results['mog2'][1]
+    print("%-8s  %10s  %10s  %9s  %9s  %12s" % ("bgsub", "ms/frame", "median", "acquired", "agree", "mean dist"))
+    for bgsub in BGSUB_MODELS:
+        times, positions = results[bgsub]
+        acquired = sum(pos is not None for pos in positions)
+        # frames where both this model and MOG2 have the fish acquired
+        dists = [math.hypot(pos[0] - ref[0], pos[1] - ref[1])
+                 for pos, ref in zip(positions, reference) if pos is not None and ref is not None]
+        # frames where both agree: the same position, or both without one
+        agree = sum(1 for pos, ref in zip(positions, reference)
+                    if (pos is None and ref is None)
+                    or (pos is not None and ref is not None and math.hypot(pos[0] - ref[0], pos[1] - ref[1]) <= tolerance))
+        print("%-8s  %10.3f  %10.3f  %8.1f%%  %8.1f%%  %9.2f px" % (
+            bgsub,
+            1000 * numpy.mean(times),
+            1000 * numpy.median(times),
+            100.0 * acquired / len(positions),
+            100.0 * agree / len(positions),
+            numpy.mean(dists) if dists else float('nan'),
+        ))
+
+
+def bench_buffers(frames, repeat):
+    for reuse_buffers in False, True:
+        # allocations (traced separately, as tracing slows everything down)
+        tracemalloc.start()
+        _, allocated = run_filters(frames, reuse_buffers, trace_memory=True)
+        tracemalloc.stop()
+
+        times = []
+        for _ in range(repeat):
+            pass_times, _ = run_filters(frames, reuse_buffers, trace_memory=False)
+            times.extend(pass_times)
+
+        label = "reused buffers" if reuse_buffers else "new allocations"
+        print("%-16s: %7.3fms / frame (median %7.3fms)   peak allocation: %8d bytes / frame" % (
+            label,
+            1000 * numpy.mean(times),
+            1000 * numpy.median(times),
+            numpy.mean(allocated[1:]),  # skip first frame, when buffers are created
+        ))
+
+
+def main():
+    testdir = config.BASEDIR / "tests"
+    default_vids = sorted(str(p) for p in testdir.glob("testvid*"))
+
+    parser = argparse.ArgumentParser(description='Benchmark tracking frame filters with and without buffer reuse, and compare background models.')
+    parser.add_argument('vidfiles', type=str, nargs='*', default=default_vids,
+                        help='videos to use (default: all videos in tests/)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of passes through each video for timing (default: 5)')
+    parser.add_argument('-t', '--tolerance', type=float, default=5,
+                        help='max distance (pixels) from the MOG2 position for a position to agree (default: 5)')
+    args = parser.parse_args()
+
+    for vidfile in args.vidfiles:
+        frames = read_frames(vidfile)
+        print("%s: %d frames, %dx%d" % (vidfile, len(frames), frames[0].shape[1], frames[0].shape[0]))
+        bench_buffers(frames, args.repeat)
+        print()
+        compare_models(frames, args.repeat, args.tolerance)
+        print()
+
+
+if __name__ == '__main__':
+    main()
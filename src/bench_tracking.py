@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# bench_tracking.py - Measure tracking throughput of the full Experiment
+#                     loop on recorded videos, with mocked wiring, stimulus,
+#                     and sensors.  Reports frames/sec, per-stage time,
+#                     Python allocations, and peak RSS, optionally as JSON
+#                     to compare against a stored baseline.
+#
+# Each run is made in a fresh Python process, so peak RSS is per-run.
+#
+# e.g.:  ./bench_tracking.py --json new.json --baseline baseline.json
+#
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy
+
+import config
+import atles_box
+from box import offline
+
+
+def run_one(vidfile, inifile, trace_alloc):
+    '''Track one video, returning a dictionary of measurements.'''
+    conf = atles_box.get_conf(argparse.Namespace(inifile=inifile, notes=None))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, 'track.csv'), 'w') as trackfile:
+            conf = offline.offline_conf(conf, trackfile, tmpdir)
+            if trace_alloc:
+                tracemalloc.start()
+            exp, elapsed = offline.run(conf, vidfile)
+
+    stages = exp.stage_timing()
+    frames = stages['subframe']['count']
+    result = {
+        'frames': frames,
+        'seconds': elapsed,
+        'fps': frames / elapsed,
+        'stages': stages,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if trace_alloc:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['alloc_peak_bytes'] = peak
+        result['alloc_retained_bytes'] = current
+    return result
+
+
+def run_worker(vidfile, inifile, trace_alloc):
+    '''Run run_one() in a new Python process, returning its measurements.'''
+    with tempfile.NamedTemporaryFile('r', suffix='.json') as outfile:
+        cmd = [sys.executable, os.path.abspath(__file__),
+               '--worker', outfile.name, '--inifile', inifile, vidfile]
+        if trace_alloc:
+            cmd.append('--trace-alloc')
+        # (the worker's output is just mocked wiring calls)
+        subprocess.check_call(cmd, stdout=subprocess.DEVNULL)
+        return json.load(outfile)
+
+
+def bench_video(vidfile, inifile, repeat, trace_alloc):
+    runs = [run_worker(vidfile, inifile, trace_alloc=False) for _ in range(repeat)]
+    fps = [run['fps'] for run in runs]
+    # report stage timing from the median run
+    median_run = sorted(runs, key=lambda run: run['fps'])[len(runs) // 2]
+
+    result = {
+        'frames': median_run['frames'],
+        'fps': numpy.median(fps),
+        'fps_min': min(fps),
+        'fps_max': max(fps),
+        'stages': median_run['stages'],
+        'peak_rss_kb': max(run['peak_rss_kb'] for run in runs),
+    }
+    if trace_alloc:
+        # allocations traced in a separate run, as tracing slows everything down
+        alloc_run = run_worker(vidfile, inifile, trace_alloc=True)
+        result['alloc_peak_bytes'] = alloc_run['alloc_peak_bytes']
+        result['alloc_retained_bytes'] = alloc_run['alloc_retained_bytes']
+    return result
+
+
+def print_result(vidfile, result):
+    print("%s: %d frames" % (vidfile, result['frames']))
+    print("  %.1f fps (min %.1f, max %.1f)   peak RSS: %d kB" % (
+        result['fps'], result['fps_min'], result['fps_max'], result['peak_rss_kb']))
+    if 'alloc_peak_bytes' in result:
+        print("  Python allocations: peak %d bytes, retained %d bytes" % (
+            result['alloc_peak_bytes'], result['alloc_retained_bytes']))
+    print("  %-21s %7s %7s %7s %7s %7s" % ("stage (ms)", "mean", "p50", "p95", "p99", "max"))
+    for stage, stats in result['stages'].items():
+        if stats['count']:
+            print("  %-21s %7.2f %7.2f %7.2f %7.2f %7.2f" % (
+                stage, stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max']))
+
+
+def compare(results, baseline, tolerance):
+    '''Print changes from the baseline, returning False if the frame rate
+    for any video dropped by more than tolerance (a fraction).'''
+    ok = True
+    print("Compared to baseline (%s, %s):" % (baseline['host'], baseline['time']))
+    for vidfile, result in results.items():
+        base = baseline['results'].get(vidfile)
+        if base is None:
+            print("%s: not in baseline" % vidfile)
+            continue
+
+        change = result['fps'] / base['fps'] - 1
+        flag = ""
+        if change < -tolerance:
+            flag = "  <-- REGRESSION"
+            ok = False
+        print("%s: %.1f fps vs. %.1f fps (%+.1f%%)%s" % (vidfile, result['fps'], base['fps'], 100*change, flag))
+
+        for stage, stats in result['stages'].items():
+            base_stats = base['stages'].get(stage)
+            if stats['count'] and base_stats and base_stats['count']:
+                print("  %-21s mean %7.3fms vs. %7.3fms (%+.1f%%)" % (
+                    stage, stats['mean'], base_stats['mean'], 100*(stats['mean'] / base_stats['mean'] - 1)))
+    return ok
+
+
+def get_args():
+    testdir = config.BASEDIR / "tests"
+    default_vids = sorted(str(p) for p in testdir.glob("testvid*"))
+
+    parser = argparse.ArgumentParser(description='Benchmark tracking on recorded videos.')
+    parser.add_argument('vidfiles', type=str, nargs='*', default=default_vids,
+                        help='video files to track (default: the test videos in %s)' % testdir)
+    parser.add_argument('--inifile', type=str, default=str(config.INIDIR / "ac_shock_left50.ini"),
+                        help='configuration file for tracking (default: ac_shock_left50.ini)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timed runs per video; the median is reported (default: 3)')
+    parser.add_argument('--no-alloc', action='store_true',
+                        help='skip the extra run per video that traces Python allocations')
+    parser.add_argument('--json', type=str, metavar='FILE',
+                        help='write results to FILE as JSON (e.g. to use as a baseline later)')
+    parser.add_argument('--baseline', type=str, metavar='FILE',
+                        help='compare results to a JSON file written by an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=10,
+                        help='with --baseline, exit with an error if fps drops by more than this percentage (default: 10)')
+    # used internally to run a single measurement in a new process
+    parser.add_argument('--worker', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--trace-alloc', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    if args.worker:
+        logging.basicConfig(level=logging.ERROR)
+        result = run_one(args.vidfiles[0], args.inifile, args.trace_alloc)
+        with open(args.worker, 'w') as f:
+            json.dump(result, f)
+        return
+
+    # results are keyed by video filename (without directories), so
+    # baselines can be compared across machines
+    results = {}
+    for vidfile in args.vidfiles:
+        name = os.path.basename(vidfile)
+        results[name] = bench_video(vidfile, args.inifile, args.repeat, not args.no_alloc)
+        print_result(name, results[name])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'host': platform.node(),
+                'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'python': platform.python_version(),
+                'opencv': cv2.__version__,
+                'inifile': args.inifile,
+                'results': results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance / 100.0):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
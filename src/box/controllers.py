@@ -1,17 +1,31 @@
+import logging
+import random
 import time
 
 
 class Controller(object):
+    '''Decides the response to each hit (a frame in which the fish is in the
+    trigger zone).  Only a count of hits and the time of the last one are
+    kept; the hits themselves are recorded in the experiment's events file.'''
     def __init__(self):
-        self._hits = []
+        self.hits = 0
+        self._last_hit = None
         self._response = 1  # static response for now
 
-    def add_hit(self, hit):
-        new_hit = {
-            'time': time.time(),
-            'hit': hit,
-        }
-        self._hits.append(new_hit)
+    def add_hit(self, hit_time=None):
+        '''Count a hit at hit_time (seconds; default: now, on the
+        time.monotonic() clock).'''
+        self.hits += 1
+        self._last_hit = hit_time if hit_time is not None else time.monotonic()
+
+
+def _seeded_rng(name, seed):
+    '''A random.Random seeded with seed, or with a random seed if that is
+    None, which is logged so the schedule can be reproduced.'''
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+        logging.info("%s: seed=%d", name, seed)
+    return random.Random(seed)
 
 
 class FixedRatioController(Controller):
@@ -21,7 +35,7 @@ class FixedRatioController(Controller):
         self._step = response_step
 
     def get_response(self):
-        if len(self._hits) % self._step == 0:
+        if self.hits % self._step == 0:
             return self._response
         else:
             return 0  # 0 = no stimulus
@@ -35,10 +49,52 @@ class FixedIntervalController(Controller):
         self._prevtime = None
 
     def get_response(self):
-        curtime = self._hits[-1]['time']
+        curtime = self._last_hit
 
         if self._prevtime is None or (curtime - self._prevtime) >= self._interval:
             self._prevtime = curtime
             return self._response
         else:
-            return None
+            return 0
+
+
+class VariableRatioController(Controller):
+    def __init__(self, mean_ratio, seed=None):
+        '''mean_ratio (int): mean #hits between responses; each ratio is drawn
+        uniformly from 1 to 2*mean_ratio-1
+        seed (int): seed for the random ratios (default: random, and logged)'''
+        super(VariableRatioController, self).__init__()
+        self._mean_ratio = mean_ratio
+        self._rng = _seeded_rng("VariableRatioController", seed)
+        self._next_hit = self._next_ratio()  # hit count of the next response
+
+    def _next_ratio(self):
+        return self._rng.randint(1, 2*self._mean_ratio - 1)
+
+    def get_response(self):
+        if self.hits >= self._next_hit:
+            self._next_hit = self.hits + self._next_ratio()
+            return self._response
+        else:
+            return 0  # 0 = no stimulus
+
+
+class VariableIntervalController(Controller):
+    def __init__(self, mean_interval, seed=None):
+        '''mean_interval (float): mean min seconds between responses; each
+        interval is drawn from an exponential distribution, so a response
+        is equally likely to become available at any moment
+        seed (int): seed for the random intervals (default: random, and logged)'''
+        super(VariableIntervalController, self).__init__()
+        self._mean_interval = mean_interval
+        self._rng = _seeded_rng("VariableIntervalController", seed)
+        self._available = None  # time from which the next response is available
+
+    def get_response(self):
+        curtime = self._last_hit
+
+        if self._available is None or curtime >= self._available:
+            self._available = curtime + self._rng.expovariate(1.0 / self._mean_interval)
+            return self._response
+        else:
+            return 0
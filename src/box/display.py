@@ -1,5 +1,7 @@
+import collections
 import logging
 import os
+import threading
 
 try:
     import pygame
@@ -56,14 +58,73 @@ def _get_screen(xwin=False):
 
 
 class Display(object):
-    ''' Class for controlling the box display '''
+    ''' Class for controlling the box display
 
-    def __init__(self):
+    Background images are decoded and scaled to the screen's size ahead of
+    time, in a background thread (see preload()), and kept in a cache of up
+    to cache_size ready-to-blit surfaces (least recently used dropped
+    first), so showing one is just a blit and a flip.
+    '''
+
+    def __init__(self, cache_size=8):
         self._screen = _get_screen()
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()  # imgfile -> scaled surface, oldest first
+        self._loading = {}  # imgfile -> Event set when its load is finished
+        self._lock = threading.Lock()
 
-    def show_image(self, imgfile):
-        logging.info("Loading background image: %s", imgfile)
+    def _load(self, imgfile):
         img = pygame.image.load(imgfile)
-        imgscaled = pygame.transform.smoothscale(img, self._screen.get_size())
-        self._screen.blit(imgscaled, (0, 0))
+        # convert to the screen's pixel format, so blitting is a plain copy
+        return pygame.transform.smoothscale(img, self._screen.get_size()).convert()
+
+    def _get_surface(self, imgfile):
+        '''Return the scaled surface for imgfile: from the cache, waiting for
+        a load in progress, or loading it now.'''
+        with self._lock:
+            if imgfile in self._cache:
+                self._cache.move_to_end(imgfile)
+                return self._cache[imgfile]
+            in_progress = self._loading.get(imgfile)
+            if in_progress is None:
+                loading = self._loading[imgfile] = threading.Event()
+
+        if in_progress is not None:
+            # being loaded by another thread; cached once that's done (or,
+            # if it failed, load it here)
+            in_progress.wait()
+            return self._get_surface(imgfile)
+
+        try:
+            logging.info("Loading background image: %s", imgfile)
+            surface = self._load(imgfile)
+            with self._lock:
+                self._cache[imgfile] = surface
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+            return surface
+        finally:
+            with self._lock:
+                del self._loading[imgfile]
+            loading.set()
+
+    def _preload_thread(self, imgfiles):
+        for imgfile in imgfiles:
+            try:
+                self._get_surface(imgfile)
+            except Exception:
+                # show_image() will report it if the image is actually needed
+                logging.exception("Preloading background image %s failed.", imgfile)
+
+    def preload(self, imgfiles):
+        '''Load and scale the given images in a background thread, in order
+        (up to the size of the cache), so later calls to show_image() for
+        them don't have to.'''
+        imgfiles = list(collections.OrderedDict.fromkeys(imgfiles))[:self._cache_size]
+        thread = threading.Thread(target=self._preload_thread, args=(imgfiles,))
+        thread.daemon = True
+        thread.start()
+
+    def show_image(self, imgfile):
+        self._screen.blit(self._get_surface(imgfile), (0, 0))
         pygame.display.flip()
@@ -1,19 +1,21 @@
 import atexit
 import collections
-import datetime
 import logging
 import numpy
-import os
 import time
 
 import cv2
 
 import config
+import trigger
 
 from box import tracking
 from box import controllers  # noqa -- 'imported but unused' because used in eval()ed expression
 from box import stimulus     # noqa -- ditto
 from box import display
+from box import phases
+from box import timing
+from box import writer
 from box import wiring
 
 try:
@@ -89,11 +91,8 @@ class Watcher(object):
             #cv2.circle(tank_overlay, position, 5, self.STATUS_COLORS[track.status])
 
             # draw a trace of the past k positions recorded
-            start = max(0, len(track.positions) - 50)
-            prevpt = track.positions[start]
-            for pt in track.positions[start:]:
-                cv2.line(tank_overlay, prevpt, pt, self.YELLOW)
-                prevpt = pt
+            trace = track.positions[-50:]
+            cv2.polylines(tank_overlay, [trace.reshape(-1, 1, 2)], False, self.YELLOW)
 
         # draw the overlay into the frame at the tank's location
         alpha = tank_overlay[:,:,3]
@@ -112,15 +111,67 @@ class Watcher(object):
         cv2.imshow("preview", frame)
 
 
+class LossRecorder(object):
+    '''Keeps the last few seconds of tank subframes in a ring buffer so
+    that, when tracking is lost, those frames and the next few seconds can
+    be saved together as one short video clip.'''
+    def __init__(self, writer, shape, fps, before, after):
+        '''shape: (h, w) of subframes; before, after: seconds of video to
+        save from before and after the loss.'''
+        self._writer = writer
+        self._fps = fps
+        self._after = int(after * fps)
+        self._ring = numpy.zeros((max(1, int(before * fps)),) + tuple(shape), numpy.uint8)
+        self._next = 0    # index in ring for the next frame
+        self._count = 0   # number of frames in ring
+        # clip being recorded, if any
+        self._clip = None
+        self._clip_pos = 0
+        self._clip_filename = None
+
+    def add_frame(self, subframe):
+        if self._clip is not None:
+            self._clip[self._clip_pos] = subframe
+            self._clip_pos += 1
+            if self._clip_pos == len(self._clip):
+                self.flush()
+
+        self._ring[self._next] = subframe
+        self._next = (self._next + 1) % len(self._ring)
+        self._count = min(self._count + 1, len(self._ring))
+
+    def trigger(self, filename):
+        '''Start recording a clip, to be saved to filename, from the frames
+        in the ring.  Returns False if a clip is already being recorded.'''
+        if self._clip is not None:
+            return False
+        start = (self._next - self._count) % len(self._ring)
+        order = (numpy.arange(self._count) + start) % len(self._ring)
+        self._clip = numpy.empty((self._count + self._after,) + self._ring.shape[1:], numpy.uint8)
+        self._ring.take(order, axis=0, out=self._clip[:self._count])
+        self._clip_pos = self._count
+        self._clip_filename = filename
+        return True
+
+    def flush(self):
+        '''Save the clip being recorded, if any (possibly incomplete).'''
+        if self._clip is None:
+            return
+        if self._writer.save_clip(self._clip_filename, self._clip[:self._clip_pos], self._fps):
+            logging.info("Saved clip %s." % self._clip_filename)
+        self._clip = None
+
+
 class Experiment(object):
 
-    def __init__(self, conf, args):
+    def __init__(self, conf, args, stream=None):
+        '''stream, if given, is used in place of the camera or args.vidfile.'''
         self._conf = conf
         self._args = args
 
         # Create Sensors
         if sensors is not None:
-            self._sensors = sensors.Sensors()
+            self._sensors = sensors.Sensors(logfile=conf.get('sensorfile'))
             self._sensors.begin()
         else:
             self._sensors = None
@@ -129,25 +180,37 @@ class Experiment(object):
         # Background image manager
         if config.HAS_DISPLAY:
             self._display = display.Display()
+            # decode and scale every background ahead of its phase
+            self._display.preload(self._background_files(conf['phases']['phases_data']))
 
         # Evaluate experiment setup expression
         self._control = eval(conf['experiment']['controller'])
         self._stim = eval(conf['experiment']['stimulus'])
 
-        trigger_exp = conf['experiment']['trigger']
-        trigger_code = compile(trigger_exp, '<string>', 'eval')
-
-        def _trigger_func(pos_tank):
-            xpos, ypos = pos_tank
-            return eval(trigger_code)
-        self._trigger = _trigger_func
+        # Compile the trigger (and any zones it uses) into a lookup grid
+        self._trigger = trigger.TriggerGrid(conf['experiment']['trigger'], conf.get('zones'))
 
         wiring.IR_on()
         if 'ambient_light_level' in conf['experiment']:
             wiring.visible_on(conf['experiment']['ambient_light_level'])
 
         # setup Stream (*after* starting stimulus, visible light bar, and IR light bar)
-        if args.vidfile:
+        # With [tracking] pipeline_slots > 0, capture and filtering run in
+        # separate processes, passing that many frames through shared memory.
+        self._pipelined = bool(conf['tracking'].get('pipeline_slots', 0)) and stream is None
+        if stream is not None:
+            self._stream = stream
+            args.width = self._stream.width
+            args.height = self._stream.height
+        elif self._pipelined:
+            # imported only if used, as it requires Python 3.8+
+            from box import pipeline
+            source = args.vidfile if args.vidfile else 0
+            self._stream = pipeline.PipelineStream(source, conf=conf['camera'], slots=conf['tracking']['pipeline_slots'])
+            if args.vidfile:
+                args.width = self._stream.width
+                args.height = self._stream.height
+        elif args.vidfile:
             self._stream = tracking.Stream(args.vidfile)
             args.width = self._stream.width
             args.height = self._stream.height
@@ -161,6 +224,8 @@ class Experiment(object):
         self._tx2 = int(self._stream.width * self._conf['camera']['tank_max_x'])
         self._ty1 = int(self._stream.height * (1.0 - self._conf['camera']['tank_max_y']))
         self._ty2 = int(self._stream.height * (1.0 - self._conf['camera']['tank_min_y']))
+        # the tank region of the current frame (see _extract_subframe())
+        self._subframe = numpy.empty((self._ty2 - self._ty1, self._tx2 - self._tx1), numpy.uint8)
 
         # Vidfile stats, if relevant
         if self._stream.sourcetype == 'file':
@@ -171,11 +236,18 @@ class Experiment(object):
         # Tracking: Simple
         tank_width = self._tx2 - self._tx1
         tank_height = self._ty2 - self._ty1
-        self._track = tracking.VelocityTracker(w=tank_width, h=tank_height)
+        self._track = tracking.VelocityTracker(
+            w=tank_width,
+            h=tank_height,
+            history=conf['tracking'].get('history_length', 1000),
+        )
 
         # Frame processing (though these feed into the Tracker, some also rely on its position estimate)
-        filt_bgsub = tracking.TargetFilterBGSub()
-        filt_bright = tracking.TargetFilterBrightness()
+        if self._pipelined:
+            filt_bgsub, filt_bright = self._stream.get_filters((self._tx1, self._tx2, self._ty1, self._ty2), conf['tracking'])
+        else:
+            filt_bgsub = tracking.make_bgsub_filter(conf['tracking'])
+            filt_bright = tracking.TargetFilterBrightness()
         filt_dist = tracking.TargetFilterDistance(self._track, maxdist=int(tank_width*0.1))
         # First try the AND of both filters' outputs;
         # then the background subtractor alone;
@@ -183,7 +255,76 @@ class Experiment(object):
         #   (brightness should only be needed if fish isn't moving,
         #    so don't accept large jumps from brightness filter)
         self._framefilters = [filt_bgsub & filt_bright, filt_bgsub, filt_bright & filt_dist]
-        self._proc = tracking.FrameProcessor()
+        self._framefilter_names = ['filter bgsub&bright', 'filter bgsub', 'filter bright&dist']
+        self._filters = [filt_bgsub, filt_bright, filt_dist]
+        if conf['tracking'].get('detector', 'contours') == 'components':
+            self._proc = tracking.ComponentFrameProcessor(
+                min_area=conf['tracking'].get('min_area', 3),
+                max_area=conf['tracking'].get('max_area'),
+            )
+        else:
+            self._proc = tracking.FrameProcessor()
+
+        # Region-of-interest tracking: while the fish is acquired, only process
+        # a square window (roi_size, as a fraction of tank width) around its
+        # predicted position, with a full frame every roi_bg_interval frames to
+        # keep the background model up to date.
+        self._roi_size = int(tank_width * conf['tracking'].get('roi_size', 0))
+        self._roi_size = min(self._roi_size, tank_width, tank_height)
+        self._roi_bg_interval = conf['tracking'].get('roi_bg_interval', 10)
+        if self._pipelined and self._roi_size:
+            # filtering process can't know the tracker's predicted position
+            logging.warn("roi_size is not supported with pipeline_slots; processing full frames.")
+            self._roi_size = 0
+
+        # Per-stage timing of the tracking loop, logged and written to
+        # conf['timingfile'] (if set; for box_interface.timing_data()) periodically.
+        self._timer = timing.StageTimer(
+            ['capture', 'subframe'] + self._framefilter_names +
+            ['centroids', 'tracker', 'sensors', 'write', 'debug frames', 'stimulus']
+        )
+        self._timingfile = conf.get('timingfile')
+        if self._timingfile is not None:
+            try:
+                self._timingfile.unlink()  # stale data from a previous experiment
+            except OSError:
+                pass
+
+        # Latency of each stimulus change, from capture of the frame that
+        # prompted it, written to conf['latencyfile'] (if set).
+        self._latencyfile = conf.get('latencyfile')
+
+        # Phase boundaries are scheduled once, at the start of run().
+        self._phases = phases.PhaseScheduler(conf['phases']['phases_data'])
+        self._phases.on_transition(self._start_phase)
+
+        # Track rows, events, and debug frames are written by a separate
+        # process, fed by a queue of up to writer_queue_size items (0 = write
+        # them directly, in the tracking loop).  Events, written to
+        # conf['eventsfile'] (if set), are one line each, in seconds from the
+        # start of the experiment:
+        #   phase,<phase number>,<scheduled time>,<actual time>  -- start of a phase
+        #   end,0,<scheduled time>,<actual time>                 -- end of the last phase
+        #   hit,<hit count>,<track time>,<response>               -- frame in the trigger zone, stimulus enabled
+        writer_queue_size = conf['tracking'].get('writer_queue_size', 100)
+        if writer_queue_size:
+            self._writer = writer.WriterProcess(conf['trackfile'], conf['debugframe_dir'], conf.get('eventsfile'), writer_queue_size)
+        else:
+            self._writer = writer.Writer(conf['trackfile'], conf['debugframe_dir'], conf.get('eventsfile'))
+        atexit.register(self._writer.close)
+
+        # Record clips of the video around each loss of tracking, if requested
+        if args.loss_clip_before:
+            fps = self._fps if self._stream.sourcetype == 'file' else conf['camera']['fps']
+            self._loss_recorder = LossRecorder(
+                self._writer,
+                shape=(tank_height, tank_width),
+                fps=fps,
+                before=args.loss_clip_before,
+                after=args.loss_clip_after,
+            )
+        else:
+            self._loss_recorder = None
 
         # For measuring status percentages
         self._statuses = collections.defaultdict(int)
@@ -195,20 +336,21 @@ class Experiment(object):
         self._prev_status = None
 
     def _write_data(self, data, frametime=None):
-        '''Write a piece of data to the track file.
+        '''Write a row of data to the track file.
 
         Arguments:
-            data: String
-                The data to write (preferably a pre-formatted string, but it
-                will be converted to a string regardless).
+            data: Tuple
+                The values to write (status, position, number of points,
+                and sensor reading sequence number; see
+                trackformat.format_row()).
             frametime: Float
                 If the input stream is from a file, this can be used to specify
                 the time (from the start of the video) of the current frame.
         '''
         if frametime is None:
             # use real time
-            frametime = time.time() - self._starttime
-        self._conf['trackfile'].write("%0.4f,%s" % (frametime, str(data)))
+            frametime = time.monotonic() - self._starttime
+        self._writer.write_row(frametime, *data)
 
     def _extract_subframe(self, frame, channel=1):
         ''' Extract the relevant portion of a frame,
@@ -217,36 +359,68 @@ class Experiment(object):
         Channels:  BGR -> Blue = 0, Green = 1 (default), Red = 2
         For atles_box: use the green channel (all are sensitive to IR, but the
         green appears to be most sensitive channel in general)
+
+        The channel is copied into one contiguous buffer, reused for every
+        frame, as OpenCV would otherwise copy the (non-contiguous) channel
+        of the frame in every function it was passed to.  A new view of the
+        buffer is returned for each frame, as the filters cache their
+        outputs by frame.
         '''
-        return frame[self._ty1:self._ty2, self._tx1:self._tx2, channel]
+        numpy.copyto(self._subframe, frame[self._ty1:self._ty2, self._tx1:self._tx2, channel])
+        return self._subframe[:]
 
     def _save_debug_frame(self, frame, subframe, frame_num, status, save_full=False):
         ''' Save a copy of the current frame for debugging. '''
-        # Save as world-writable so rsync can delete them.
-        oldmask = os.umask(0)
-        subimgfile = "%s/subframe_%05d_%s.png" % (self._conf['debugframe_dir'], frame_num, status)
-        cv2.imwrite(subimgfile, subframe)
+        if not self._writer.save_frame(frame_num, 'subframe', status, subframe):
+            return  # dropped; writer is busy
         if save_full:
-            imgfile = "%s/frame_%05d_%s.png" % (self._conf['debugframe_dir'], frame_num, status)
-            cv2.imwrite(imgfile, frame)
-        os.umask(oldmask)
+            self._writer.save_frame(frame_num, 'frame', status, frame)
         logging.info("Saved frame %d." % frame_num)
 
     def _apply_filters(self, frame):
         '''Apply our stored filters to the frame, one at at time, until one
         returns a non-empty result.  Return that result.'''
-        for filter in self._framefilters:
+        for filter, name in zip(self._framefilters, self._framefilter_names):
             output = filter(frame)
-            if numpy.any(output):
+            # countNonZero() is numpy.any() without allocating a temporary
+            nonempty = cv2.countNonZero(output)
+            self._timer.lap(name)
+            if nonempty:
                 return output
         # if we get here, they were all empty, so return the last one (which is empty)
         return output
 
-    def _do_tracking(self, frame, frame_num, phase_data):
+    def _get_roi(self, frame_num):
+        '''Return the region of the tank (x1, y1, x2, y2) to process in this
+        frame, or None if the whole tank should be processed.'''
+        if not self._roi_size or self._track.status != 'acquired':
+            return None
+        if frame_num % self._roi_bg_interval == 0:
+            return None
+
+        # A window of constant size, centered on the predicted position
+        # but shifted as needed to stay entirely within the tank.
+        x, y = self._track.position_predicted
+        tank_width = self._tx2 - self._tx1
+        tank_height = self._ty2 - self._ty1
+        x1 = min(max(0, x - self._roi_size // 2), tank_width - self._roi_size)
+        y1 = min(max(0, y - self._roi_size // 2), tank_height - self._roi_size)
+        return (x1, y1, x1 + self._roi_size, y1 + self._roi_size)
+
+    def _do_tracking(self, frame, frame_num, frame_time, phase_data):
         # Process the frame (finds contours, centroids, and updates background subtractor)
         subframe = self._extract_subframe(frame)
+        if self._loss_recorder is not None:
+            self._loss_recorder.add_frame(subframe)
+        roi = self._get_roi(frame_num)
+        for filter in self._filters:
+            filter.set_roi(roi)
+        self._timer.lap('subframe')
         filtered = self._apply_filters(subframe)
-        self._proc.new_frame(filtered)
+        self._proc.new_frame(filtered, offset=roi[:2] if roi else (0, 0))
+        # contours/centroids are found lazily, so include that here
+        self._proc.centroids
+        self._timer.lap('centroids')
 
         if frame_num == 1:
             self._save_debug_frame(frame, subframe, frame_num, 'start', save_full=True)
@@ -260,6 +434,7 @@ class Experiment(object):
 
         # Update tracker w/ latest set of centroids
         self._track.update(self._proc.centroids)
+        self._timer.lap('tracker')
         # Get the position estimate of the fish and tracking status from the tracker
         # pos_pixel = self._track.position_pixel
         pos_tank = self._track.position_tank
@@ -268,56 +443,81 @@ class Experiment(object):
         # Update status counts
         self._statuses[status] += 1
 
-        # Get latest sensor readings
+        # Get the sequence number of the latest sensor reading (the reading
+        # itself is logged by the sensor process); 0 for none.
         if self._sensors is not None:
-            sensor_vals = self._sensors.get_latest()
+            sensor_seq = self._sensors.get_latest().seq
         else:
-            sensor_vals = {'time': datetime.datetime.now(), 'temp': -1.0, 'lux': -1}
+            sensor_seq = 0
+        self._timer.lap('sensors')
 
         # Record data
-        if pos_tank[0] is None:
-            report_pos = ".,."
-        else:
-            report_pos = "%0.3f,%0.3f" % (pos_tank[0], pos_tank[1])
-
-        data = "%s,%s,%d,%0.2f,%d\n" % (status, report_pos, len(self._proc.centroids), sensor_vals['temp'], sensor_vals['lux'])
+        data = (status, pos_tank, len(self._proc.centroids), sensor_seq)
 
         if self._stream.sourcetype == 'file':
-            self._write_data(data, frametime=frame_num*1.0/self._fps)
+            track_time = frame_num*1.0/self._fps
         else:
-            self._write_data(data)
-
-        if self._args.debug_frames:
-            if status != 'acquired' and self._prev_status == 'acquired':
-                # save a frame whenever we first lose tracking (transition from acquired to not)
-                self._save_debug_frame(frame, subframe, frame_num, status)
-            if frame_num % self._args.debug_frames == 0:
-                # save a frame every "debug_frames" frames
+            # time the frame was captured, not the time it was processed
+            track_time = frame_time - self._starttime
+        self._write_data(data, frametime=track_time)
+        self._timer.lap('write')
+
+        if status != 'acquired' and self._prev_status == 'acquired':
+            # we've just lost tracking (transition from acquired to not)
+            if self._loss_recorder is not None:
+                # record a clip of the video leading up to and following the loss
+                clipfile = "%s/clip_%05d_%s.avi" % (self._conf['debugframe_dir'], frame_num, status)
+                self._loss_recorder.trigger(clipfile)
+            elif self._args.debug_frames:
+                # save a frame whenever we first lose tracking
                 self._save_debug_frame(frame, subframe, frame_num, status)
+        if self._args.debug_frames and frame_num % self._args.debug_frames == 0:
+            # save a frame every "debug_frames" frames
+            self._save_debug_frame(frame, subframe, frame_num, status)
+        self._timer.lap('debug frames')
 
-        if status != 'lost' and status != 'init' and self._trigger(pos_tank):
+        if status != 'lost' and status != 'init' and self._trigger.test(*pos_tank):
             # Only provide a stimulus if we know where the fish is
             # and the behavior test for that position says we should.
             if phase_data.dostim:
-                self._control.add_hit(str(pos_tank))
+                self._control.add_hit(track_time)
                 response = self._control.get_response()
-                self._stim.show(response)
+                self._writer.write_event("hit,%d,%0.4f,%s\n" % (self._control.hits, track_time, response))
+                self._stim.show(response, frame_time)
         else:
-            self._stim.show(0)  # 0 = no stimulus
+            self._stim.show(0, frame_time)  # 0 = no stimulus
+        self._timer.lap('stimulus')
 
         self._prev_status = status
 
-    def _get_phase_data(self, runningtime):
-        t_sum = 0
-        for p in self._conf['phases']['phases_data']:
-            t_sum += p.length*60
-            if runningtime < t_sum:
-                return p
-        # if we get here, we've run longer than the sum of all phase lengths
-        return 'done'
+    @staticmethod
+    def _background_files(phases_data):
+        return [str(config.IMGDIR / p.background) for p in phases_data]
+
+    def _start_phase(self, transition):
+        '''Called by the phase scheduler at each phase boundary.'''
+        phase_data = transition.phase
+        kind, num = ('phase', phase_data.phasenum) if phase_data is not None else ('end', 0)
+        self._writer.write_event("%s,%d,%0.4f,%0.4f\n" % (kind, num, transition.scheduled, transition.actual))
+
+        if phase_data is None:
+            logging.info("End of last phase reached; exiting.")
+            return
+
+        logging.info("Starting phase: %s" % (str(phase_data)))
+        self._writer.mark('phase', phase_data.phasenum)
+        if not phase_data.dostim:
+            self._stim.show(0)  # no stimulus from the moment the phase starts
+        if config.HAS_DISPLAY:
+            self._display.show_image(self._background_files([phase_data])[0])
+            # stage the following phases' backgrounds, in case they didn't
+            # all fit in the display's cache
+            phases_data = self._conf['phases']['phases_data']
+            self._display.preload(self._background_files(phases_data[phases_data.index(phase_data)+1:]))
 
     def run(self):
         self._stim.begin()
+        self._writer.start()
 
         # Create Watcher here because preview window seems to need to be
         # created/managed in same thread under Windows, and this method is
@@ -325,26 +525,39 @@ class Experiment(object):
         if self._args.watch:
             _watcher = Watcher(self._tx1, self._tx2, self._ty1, self._ty2)
 
-        prevtime = time.time()
+        # (set before capture starts, as frames are timed from it)
+        self._starttime = time.monotonic()
+
+        # Capture in a separate thread, if configured
+        queue_size = self._conf['camera'].get('capture_queue_size', 0)
+        if self._pipelined:
+            # already captured in a separate process
+            stream = self._stream
+            stream.start()
+        elif queue_size:
+            if self._stream.sourcetype == 'file':
+                drop_policy = 'block'  # process every frame of a file
+            else:
+                drop_policy = self._conf['camera'].get('capture_drop_policy', 'oldest')
+            stream = tracking.ThreadedStream(self._stream, queue_size, drop_policy)
+            stream.start()
+        else:
+            stream = self._stream
+
+        prevtime = time.monotonic()
         frame_num = 0
 
-        self._starttime = time.time()
+        if self._latencyfile is not None:
+            self._stim.record_latency(self._latencyfile, self._starttime)
 
-        phase_data = None
+        self._phases.start(self._starttime)
 
         while True:
-            curtime = time.time()
+            curtime = time.monotonic()
 
-            new_phase_data = self._get_phase_data(curtime-self._starttime)
-            if new_phase_data == 'done':
-                logging.info("End of last phase reached; exiting.")
+            phase_data = self._phases.update(curtime)
+            if phase_data is None:
                 break
-            elif new_phase_data != phase_data:
-                phase_data = new_phase_data
-                logging.info("Starting phase: %s" % (str(phase_data)))
-                if config.HAS_DISPLAY:
-                    imgfile = str(config.IMGDIR / phase_data.background)
-                    self._display.show_image(imgfile)
 
             stim_msg = self._stim.msg_poll()
             if stim_msg == 'safety limit reached':
@@ -354,7 +567,9 @@ class Experiment(object):
                 logging.info("Stimulus window closed; exiting.")
                 break
 
-            rval, frame = self._stream.get_frame()
+            self._timer.start()
+            rval, frame = stream.get_frame()
+            self._timer.lap('capture')
 
             if not rval:
                 logging.warn("stream.get_frame() rval != True")
@@ -362,26 +577,61 @@ class Experiment(object):
 
             frame_num += 1
 
-            self._do_tracking(frame, frame_num, phase_data)
+            self._do_tracking(frame, frame_num, stream.frame_time, phase_data)
 
             if self._args.watch:
                 _watcher.draw_watch(frame, self._track, self._proc)
                 if cv2.waitKey(1) % 256 == 27:
                     logging.info("Escape pressed in preview window; exiting.")
                     break
+                self._timer.lap('watch')
 
             # tracking performance / FPS
             if frame_num % 1000 == 0:
                 frame_time = (curtime - prevtime) / 1000
                 logging.info("%dms / frame : %dfps", 1000*frame_time, 1/frame_time)
                 prevtime = curtime
+                if stream.dropped:
+                    logging.info("Capture: %d frames dropped so far", stream.dropped)
+                self._timer.log()
+                if self._timingfile is not None:
+                    self._timer.write(self._timingfile)
 
             if self._args.delay:
                 time.sleep(self._args.delay / 1000.0)
 
+        if self._timingfile is not None:
+            self._timer.write(self._timingfile)
+        if self._loss_recorder is not None:
+            self._loss_recorder.flush()
+        self._writer.close()
+        self._stim.end()
+
+        if stream is not self._stream:
+            stream.stop()
+        if stream.dropped:
+            logging.warn("Capture: %d frames dropped (processing could not keep up).", stream.dropped)
+
+    def stimulus_latency(self):
+        '''Latency from frame capture to stimulus change: {count, mean, p50,
+        p95, p99, max}, in ms, or None if not recorded.  Available after
+        run().'''
+        return self._stim.latency_summary()
+
+    def stage_timing(self):
+        '''Per-stage timing of the tracking loop so far: {stage: {count, mean,
+        p50, p95, p99, max}}, with times in ms.'''
+        return self._timer.summary()
+
+    def print_stats(self):
+        '''Print status percentages now, rather than at exit.'''
+        atexit.unregister(self._print_stats)
+        self._print_stats()
+
     def _print_stats(self):
         '''Print status percentages.'''
         total = sum(self._statuses.values())
         logging.info("Status percentages:")
         for status, count in self._statuses.items():
             logging.info("{0:>10}: {1:4.1f}".format(status, 100*count/float(total)))
+        self._timer.log()
@@ -0,0 +1,200 @@
+'''Running an Experiment on a recorded video without the box hardware.
+
+Wiring is mocked automatically when wiringpi is not available (see
+box/wiring.py); sensors are never read, and the stimulus is replaced with
+a DummyStimulus so no stimulus hardware is touched.
+
+A long video can also be tracked in segments, in parallel, and the
+segments' tracks stitched back together: see plan_segments() and stitch().
+'''
+import argparse
+import collections
+import contextlib
+import math
+import os
+import time
+
+import cv2
+
+from common import Phase
+from trackformat import CSVTrackWriter
+from box import experiment
+from box import tracking
+
+
+# A segment of a video to track, in 0-based frame indices: frames first to
+# last-1 are read, and the track is recorded from frame output (at which
+# point the background model has had output-first frames to warm up).
+Segment = collections.namedtuple('Segment', ['first', 'output', 'last'])
+
+
+class SegmentStream(tracking.Stream):
+    '''A Stream of just the frames of segment (a Segment) of a video file.'''
+    def __init__(self, vidfile, segment):
+        super(SegmentStream, self).__init__(vidfile)
+        self._remaining = segment.last - segment.first
+        if segment.first:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, segment.first)
+            if int(self._video.get(cv2.CAP_PROP_POS_FRAMES)) != segment.first:
+                # Can't seek in this file (e.g., a raw .h264 stream), so
+                # start over and skip to the first frame.
+                self._video.release()
+                self._video = cv2.VideoCapture(vidfile)
+                for _ in range(segment.first):
+                    self._video.grab()
+
+    def get_frame(self):
+        if self._remaining <= 0:
+            return False, None
+        self._remaining -= 1
+        return super(SegmentStream, self).get_frame()
+
+
+def count_frames(vidfile):
+    '''Return the number of frames in a video file and its frame rate.'''
+    video = cv2.VideoCapture(vidfile)
+    framecount = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = video.get(cv2.CAP_PROP_FPS)
+    if framecount <= 0:
+        # not stored in the file (e.g., a raw .h264 stream): count them
+        framecount = 0
+        while video.grab():
+            framecount += 1
+    video.release()
+    return framecount, fps
+
+
+def plan_segments(framecount, length, warmup, overlap, start_frame):
+    '''Split a video of framecount frames into segments of (up to) length
+    frames each.
+
+    Every segment after the first starts warmup+overlap frames before its
+    nominal start: the background model warms up for warmup frames, and
+    the track is recorded for the last overlap frames of the previous
+    segment as well, for stitch() to find where the two agree.  The first
+    segment starts at the start of the video and records from start_frame,
+    as a single run would.
+    '''
+    segments = [Segment(0, start_frame - 1, min(length, framecount))]
+    for start in range(length, framecount, length):
+        output = max(0, start - overlap)
+        first = max(0, output - warmup)
+        segments.append(Segment(first, output, min(start + length, framecount)))
+    return segments
+
+
+def _parse_rows(rows, segment, fps):
+    '''Return {frame index: row} for the track rows (strings) of a segment,
+    with each row's time adjusted from the start of the segment to the start
+    of the video.'''
+    frames = {}
+    for row in rows:
+        segtime, rest = row.split(',', 1)
+        # Experiment gives a frame time of frame_num/fps, with frame_num
+        # starting at 1
+        frame = segment.first + int(round(float(segtime) * fps)) - 1
+        frames[frame] = "%0.4f,%s" % ((frame + 1) / fps, rest)
+    return frames
+
+
+def _rows_agree(row1, row2, tolerance):
+    '''Return True if two track rows have the fish acquired at the same
+    position (within tolerance, in tank coordinates).'''
+    status1, x1, y1 = row1.split(',')[1:4]
+    status2, x2, y2 = row2.split(',')[1:4]
+    if status1 != 'acquired' or status2 != 'acquired':
+        return False
+    return math.hypot(float(x1) - float(x2), float(y1) - float(y2)) <= tolerance
+
+
+def stitch(segments, tracks, fps, tolerance=0.005):
+    '''Stitch the tracks of segments (from plan_segments()) into one.
+
+    tracks holds each segment's track, as a list of rows (strings, as
+    written to a track file).  Where two segments overlap, the earlier
+    segment's track is used up to the first frame at which both segments
+    have the fish acquired at the same position, and the later segment's
+    from then on.  Their trackers are in the same state from that point,
+    so the stitched track matches what a single run would have produced
+    as closely as possible.  If they never agree, the switch is made at the
+    end of the earlier segment.
+
+    Returns the stitched rows and a list of the frames at which each switch
+    was made (None where the segments never agreed).
+    '''
+    stitched = _parse_rows(tracks[0], segments[0], fps)
+    switches = []
+    for segment, rows in zip(segments[1:], tracks[1:]):
+        frames = _parse_rows(rows, segment, fps)
+        overlap = sorted(frame for frame in frames if frame in stitched)
+        switch = None
+        for frame in overlap:
+            if _rows_agree(stitched[frame], frames[frame], tolerance):
+                switch = frame
+                break
+        switches.append(switch)
+        if switch is None:
+            switch = overlap[-1] + 1 if overlap else segment.output
+        for frame in frames:
+            if frame >= switch:
+                stitched[frame] = frames[frame]
+    return [stitched[frame] for frame in sorted(stitched)], switches
+
+
+def offline_conf(conf, trackfile, debugframe_dir, indexfile=None):
+    '''Return a copy of conf (as read from an ini file) set up for running
+    offline: a single infinite phase with stimulus "enabled" (so controller
+    and stimulus dispatch are still exercised), a dummy stimulus, and the
+    given track file object (written as CSV, with its index written to
+    indexfile, a text file object, if given) and debug frame directory.'''
+    conf = {section: dict(values) for section, values in conf.items() if isinstance(values, dict)}
+    conf['experiment']['stimulus'] = 'stimulus.DummyStimulus()'
+    conf['phases'] = {'phases_data': [Phase(1, float('inf'), True, 'black.png')]}
+    conf['trackfile'] = CSVTrackWriter(trackfile, index=indexfile)
+    conf['debugframe_dir'] = debugframe_dir
+    return conf
+
+
+def offline_args(vidfile, debug_frames=0):
+    '''Arguments for an Experiment, as atles_box.get_args() would produce.'''
+    return argparse.Namespace(
+        id='',
+        watch=False,
+        debug_frames=debug_frames,
+        loss_clip_before=0,
+        loss_clip_after=0,
+        notes=None,
+        phases=None,
+        inifile=None,
+        vidfile=vidfile,
+        delay=0,
+    )
+
+
+def run(conf, vidfile, debug_frames=0, quiet=True, segment=None):
+    '''Track the given video with conf (from offline_conf()), or just the
+    given segment of it (a Segment).
+
+    Returns the Experiment (after running) and the time it took to run in
+    seconds.  With quiet=True, stdout (used by the mocked wiring and the
+    dummy stimulus) is discarded while the experiment is created and run.
+    '''
+    experiment.sensors = None  # never read real sensors offline
+
+    if quiet:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return run(conf, vidfile, debug_frames, quiet=False, segment=segment)
+
+    stream = None
+    if segment is not None:
+        stream = SegmentStream(vidfile, segment)
+        # record the track from segment.output (frame numbers from 1)
+        conf['tracking'] = dict(conf['tracking'], start_frame=segment.output - segment.first + 1)
+    exp = experiment.Experiment(conf, offline_args(vidfile, debug_frames), stream=stream)
+    start = time.perf_counter()
+    exp.run()
+    elapsed = time.perf_counter() - start
+    # logged at exit normally, but atexit handlers don't run in pool workers
+    exp.print_stats()
+
+    return exp, elapsed
@@ -0,0 +1,80 @@
+'''Scheduling an experiment's phases.
+
+PhaseScheduler computes the (monotonic clock) deadline of every phase
+boundary once, at the start of the experiment, so checking for a phase
+change on each frame is a single comparison.  At each boundary, it calls
+the registered transition callbacks and records when the transition
+actually happened, for comparison with when it was scheduled.
+'''
+import collections
+import itertools
+
+
+# A phase boundary: the phase starting (None at the end of the last phase),
+# and the times it was scheduled for and actually happened, in seconds from
+# the start of the experiment.
+Transition = collections.namedtuple('Transition', ['phase', 'scheduled', 'actual'])
+
+
+class PhaseScheduler(object):
+    '''Schedules a list of phases (common.Phase, with lengths in minutes).
+
+    Callbacks registered with on_transition() are called as
+    callback(transition) at each boundary, with a Transition.  If update()
+    is called late enough that whole phases were missed, each missed phase
+    still gets its transition (all with the same actual time), so every
+    phase is accounted for.
+    '''
+    def __init__(self, phases):
+        self._phases = list(phases)
+        # offset of the end of each phase from the start, in seconds
+        self._ends = list(itertools.accumulate(p.length * 60 for p in self._phases))
+        self._callbacks = []
+        self._starttime = None
+        self._index = -1  # of the current phase
+        self._deadline = float('inf')  # of the current phase
+        self.transitions = []
+
+    def on_transition(self, callback):
+        self._callbacks.append(callback)
+
+    def start(self, now):
+        '''Start the first phase at now (time.monotonic()).'''
+        self._starttime = now
+        self._index = -1
+        self._deadline = now  # so the first update() starts the first phase
+        self.transitions = []
+        self.update(now)
+
+    @property
+    def phase(self):
+        '''The current phase, or None before the start or after the end of
+        the last phase.'''
+        if 0 <= self._index < len(self._phases):
+            return self._phases[self._index]
+        return None
+
+    @property
+    def done(self):
+        return self._index >= len(self._phases)
+
+    def update(self, now):
+        '''Advance to the phase scheduled for now (time.monotonic()),
+        calling the transition callbacks for every boundary passed.
+        Returns the current phase (None once done).'''
+        if now < self._deadline:
+            return self.phase
+
+        while now >= self._deadline:
+            scheduled = self._deadline - self._starttime
+            self._index += 1
+            if self._index < len(self._phases):
+                self._deadline = self._starttime + self._ends[self._index]
+            else:
+                self._deadline = float('inf')
+            transition = Transition(self.phase, scheduled, now - self._starttime)
+            self.transitions.append(transition)
+            for callback in self._callbacks:
+                callback(transition)
+
+        return self.phase
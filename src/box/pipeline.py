@@ -0,0 +1,287 @@
+'''Pipelined tracking: capture, filtering, and tracking in separate processes.
+
+Frame capture runs in one process, background subtraction and brightness
+filtering in another, and the remaining tracking (combining filter outputs,
+finding centroids, updating the tracker, and stimulus) in the experiment's
+own process.  Frames and filter outputs are passed between processes through
+rings of slots in shared memory; only slot numbers and capture times go
+through the queues connecting the stages.  Every stage handles frames in
+the order they were captured.
+
+Requires Python 3.8+ (multiprocessing.shared_memory).
+'''
+import atexit
+import logging
+import multiprocessing
+import signal
+from multiprocessing import resource_tracker, shared_memory
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy
+
+from box import tracking
+
+
+class SharedRing(object):
+    '''A fixed number of equally-shaped numpy arrays ("slots") in shared memory.
+
+    Create a new ring in one process with name=None, then attach to it from
+    others using its name.
+    '''
+    def __init__(self, slots, shape, dtype=numpy.uint8, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        if name is None:
+            size = slots * int(numpy.prod(self.shape)) * self.dtype.itemsize
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._owner = (name is None)
+        self.name = self._shm.name
+        self._array = numpy.ndarray((slots,) + self.shape, self.dtype, buffer=self._shm.buf)
+
+    def attach_args(self):
+        '''Arguments for creating a SharedRing attached to this one in another process.'''
+        return (self.slots, self.shape, self.dtype.str, self.name)
+
+    def __getitem__(self, slot):
+        return self._array[slot]
+
+    def close(self):
+        self._array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _ignore_signals():
+    # ignore signals that will be handled by parent
+    signal.signal(signal.SIGALRM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _capture_process(source, conf, info_pipe, free_slots, captured):
+    '''Capture frames into free slots of the frame ring.'''
+    _ignore_signals()
+
+    if source == 0:
+        stream = tracking.Stream(0, conf=conf, params={})
+    else:
+        stream = tracking.Stream(source)
+    stats = stream.get_video_stats() if stream.sourcetype == 'file' else None
+    info_pipe.send((stream.width, stream.height, stream.sourcetype, stats))
+
+    # wait for the frame ring to be created and the pipeline to be started
+    ring_args = info_pipe.recv()
+    if ring_args is None:
+        return
+    frames = SharedRing(*ring_args)
+
+    dropped = 0
+    while True:
+        if stream.sourcetype == 'file':
+            slot = free_slots.get()  # process every frame of a file
+        else:
+            # if all slots are in use, processing is behind: drop this frame
+            try:
+                slot = free_slots.get_nowait()
+            except queue.Empty:
+                stream.get_frame()
+                dropped += 1
+                continue
+
+        if slot is None:
+            captured.put(None)
+            break
+
+        rval, frame = stream.get_frame()
+        if not rval:
+            captured.put(None)
+            break
+
+        frames[slot][:] = frame
+        captured.put((slot, stream.frame_time, dropped))
+
+    frames.close()
+
+
+def _filter_process(ring_args, bounds, tracking_conf, captured, filtered):
+    '''Apply the background subtraction and brightness filters to each captured frame.'''
+    _ignore_signals()
+
+    frames = SharedRing(*ring_args['frames'])
+    bgsub_masks = SharedRing(*ring_args['bgsub'])
+    bright_masks = SharedRing(*ring_args['bright'])
+    tx1, tx2, ty1, ty2 = bounds
+
+    filt_bgsub = tracking.make_bgsub_filter(tracking_conf)
+    filt_bright = tracking.TargetFilterBrightness()
+    subframe = numpy.empty((ty2 - ty1, tx2 - tx1), numpy.uint8)
+
+    while True:
+        item = captured.get()
+        if item is None:
+            filtered.put(None)
+            break
+
+        slot = item[0]
+        # same as Experiment._extract_subframe()
+        numpy.copyto(subframe, frames[slot][ty1:ty2, tx1:tx2, 1])
+        frame = subframe[:]
+        numpy.copyto(bgsub_masks[slot], filt_bgsub(frame))
+        numpy.copyto(bright_masks[slot], filt_bright(frame))
+        filtered.put(item)
+
+    for ring in frames, bgsub_masks, bright_masks:
+        ring.close()
+
+
+class TargetFilterShared(tracking.TargetFilterBase):
+    '''Stands in for a filter that is applied in the filtering process,
+    returning that filter's output for the current frame from shared memory.'''
+    def __init__(self, ring):
+        super(TargetFilterShared, self).__init__()
+        self._ring = ring
+        self._slot = None
+
+    def set_slot(self, slot):
+        self._slot = slot
+        self._cache = (None, None)
+
+    def _do_filter(self, frame):
+        return self._ring[self._slot]
+
+
+class PipelineStream(object):
+    '''Provides frames (and background subtraction and brightness filter
+    outputs for them) from the capture and filtering processes.
+
+    Used in place of a tracking.Stream: it has the same width, height,
+    sourcetype, get_video_stats(), get_frame(), and frame_time.  Each frame
+    returned by get_frame() lives in shared memory and is only valid until
+    the next call to get_frame().
+    '''
+    def __init__(self, source, conf=None, slots=4):
+        self._slots = slots
+        self.frame_time = None
+        self.dropped = 0
+        self._frames = self._bgsub_masks = self._bright_masks = None
+        self._filter = None
+        self._slot = None  # slot of current frame
+        self._ended = False
+
+        self._free_slots = multiprocessing.Queue()
+        self._captured = multiprocessing.Queue()
+        self._filtered = multiprocessing.Queue()
+        self._info_pipe, child_pipe = multiprocessing.Pipe()
+
+        # Start the resource tracker (which removes leaked shared memory)
+        # now, so child processes share it rather than starting their own,
+        # which would remove the rings as soon as each child exits.
+        resource_tracker.ensure_running()
+
+        self._capture = multiprocessing.Process(
+            target=_capture_process,
+            args=(source, conf, child_pipe, self._free_slots, self._captured)
+        )
+        self._capture.daemon = True
+        self._capture.start()
+        atexit.register(self.end)
+
+        # wait for the stream to be opened
+        while not self._info_pipe.poll(0.5):
+            if not self._capture.is_alive():
+                raise RuntimeError("Capture process failed to open video stream.")
+        self.width, self.height, self.sourcetype, self._stats = self._info_pipe.recv()
+
+        self._frames = SharedRing(slots, (self.height, self.width, 3))
+
+    def get_video_stats(self):
+        assert(self.sourcetype == 'file')
+        return self._stats
+
+    def get_filters(self, bounds, tracking_conf=None):
+        '''Return stand-ins for the background subtraction and brightness
+        filters, applied in the filtering process to the tank region given by
+        bounds (tx1, tx2, ty1, ty2).  tracking_conf (the [tracking] section)
+        selects the background subtraction filter (see
+        tracking.make_bgsub_filter()).'''
+        tx1, tx2, ty1, ty2 = bounds
+        self._bounds = bounds
+        self._tracking_conf = tracking_conf
+        self._bgsub_masks = SharedRing(self._slots, (ty2-ty1, tx2-tx1))
+        self._bright_masks = SharedRing(self._slots, (ty2-ty1, tx2-tx1))
+        self._filt_bgsub = TargetFilterShared(self._bgsub_masks)
+        self._filt_bright = TargetFilterShared(self._bright_masks)
+        return self._filt_bgsub, self._filt_bright
+
+    def start(self):
+        '''Start capturing and filtering frames.'''
+        ring_args = {
+            'frames': self._frames.attach_args(),
+            'bgsub': self._bgsub_masks.attach_args(),
+            'bright': self._bright_masks.attach_args(),
+        }
+        self._filter = multiprocessing.Process(
+            target=_filter_process,
+            args=(ring_args, self._bounds, self._tracking_conf, self._captured, self._filtered)
+        )
+        self._filter.daemon = True
+        self._filter.start()
+
+        for slot in range(self._slots):
+            self._free_slots.put(slot)
+        self._info_pipe.send(ring_args['frames'])
+
+    def get_frame(self):
+        # previous frame is done
+        if self._slot is not None:
+            self._free_slots.put(self._slot)
+            self._slot = None
+
+        while True:
+            try:
+                item = self._filtered.get(timeout=0.5)
+                break
+            except queue.Empty:
+                # a process that has failed will never send the frame (or the
+                # end of the stream), so end the stream here (each exits
+                # normally, with exitcode 0, only once the stream has ended)
+                for name, p in ('capture', self._capture), ('filter', self._filter):
+                    if p.exitcode not in (None, 0):
+                        logging.error("Pipeline %s process failed (exit code %d).", name, p.exitcode)
+                        return False, None
+        if item is None:
+            return False, None
+
+        self._slot, self.frame_time, self.dropped = item
+        self._filt_bgsub.set_slot(self._slot)
+        self._filt_bright.set_slot(self._slot)
+        return True, self._frames[self._slot]
+
+    def end(self):
+        if self._ended:
+            return
+        self._ended = True
+
+        if self._capture.is_alive():
+            if self._filter is None:
+                # capture process is still waiting to be started
+                self._info_pipe.send(None)
+            else:
+                self._free_slots.put(None)
+        for p in self._capture, self._filter:
+            if p is not None:
+                p.join(timeout=1)
+                if p.is_alive():
+                    p.terminate()
+
+        for ring in self._frames, self._bgsub_masks, self._bright_masks:
+            if ring is not None:
+                ring.close()
+        self._frames = self._bgsub_masks = self._bright_masks = None
@@ -1,21 +1,56 @@
+'''Reading the box's temperature and light sensors in a separate process.
+
+The sensor process publishes each reading in a small block of shared memory
+(a "seqlock": a sequence counter that is odd while a reading is being
+written, followed by the reading itself), so the tracking loop can get the
+latest reading at any time without locks, pipes, or system calls.  Every
+reading has a sequence number (1 for the first), which the track records
+in place of the reading itself; the readings are logged at full resolution
+to their own file, one line per reading: "seq,time,temp,lux" (time in
+seconds since the epoch).
+'''
 import atexit
+import collections
 import multiprocessing
 import signal
+import time
 
 from TSL2561 import TSL2561
 from MCP9808 import MCP9808
-import datetime
-import time
+
+
+Reading = collections.namedtuple('Reading', ['seq', 'time', 'temp', 'lux'])
+
+# slots in the shared array
+_COUNTER, _TIME, _TEMP, _LUX = range(4)
 
 
 class Sensors(object):
-    ''' Class for reading and reporting sensor values '''
-    def __init__(self, read_interval=1):
-        self._child_pipe, self._pipe = multiprocessing.Pipe(duplex=True)
+    ''' Class for reading and reporting sensor values
+
+    logfile, if given, is the name of a file to which every reading is
+    written (see the module docstring).
+    '''
+    def __init__(self, read_interval=1, logfile=None):
         self._read_interval = read_interval
-        self._readings = None
+        self._logfile = logfile
+        # written only by the sensor process, so no lock is needed
+        self._slot = multiprocessing.RawArray('d', 4)
+        self._first_reading = multiprocessing.Event()
+        self._end = multiprocessing.Event()
+        self._p = None
+
+    def _publish(self, timestamp, temp, lux):
+        slot = self._slot
+        counter = slot[_COUNTER]
+        slot[_COUNTER] = counter + 1  # odd: reading in progress
+        slot[_TIME] = timestamp
+        slot[_TEMP] = temp
+        slot[_LUX] = lux
+        slot[_COUNTER] = counter + 2  # even: reading complete
+        return int(counter + 2) // 2
 
-    def _sensors_thread(self, pipe):
+    def _sensors_thread(self):
         # ignore signals that will be handled by parent
         signal.signal(signal.SIGALRM, signal.SIG_IGN)
         signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -24,7 +59,9 @@ class Sensors(object):
         mcp = MCP9808(debug=0)
         #tsl.set_gain(16)
 
-        while True:
+        log = open(self._logfile, 'w') if self._logfile is not None else None
+
+        while not self._end.is_set():
             temp = mcp.read_temp()
             #print("%0.2f degC" % temp)
 
@@ -33,31 +70,41 @@ class Sensors(object):
             lux = tsl.read_lux()
             #print("%d,%d = %d lux" % (full, ir, lux))
 
-            pipe.send({'time': datetime.datetime.now(), 'temp': temp, 'lux': lux})
+            timestamp = time.time()
+            seq = self._publish(timestamp, temp, lux)
+            self._first_reading.set()
+
+            if log is not None:
+                log.write("%d,%0.3f,%0.2f,%d\n" % (seq, timestamp, temp, lux))
+                log.flush()
 
-            # check for end signal
-            while pipe.poll():
-                val = pipe.recv()
-                if val == 'end' or val is None:
-                    return
+            # sleep, but wake immediately if told to end
+            self._end.wait(self._read_interval)
 
-            time.sleep(self._read_interval)
+        if log is not None:
+            log.close()
 
     def begin(self):
-        self._p = multiprocessing.Process(target=self._sensors_thread, args=(self._child_pipe,))
+        self._p = multiprocessing.Process(target=self._sensors_thread)
         self._p.start()
         atexit.register(self.end)
-        # Get an initial reading (so get_latest() is guaranteed to return something)
-        self._readings = self._pipe.recv()
+        # Wait for an initial reading (so get_latest() is guaranteed to return something)
+        self._first_reading.wait()
 
     def end(self):
-        self._pipe.send('end')
-        # clear queue before joining
-        while self._pipe.poll():
-            self._pipe.recv()
+        if self._p is None:
+            return
+        self._end.set()
         self._p.join()
+        self._p = None
 
     def get_latest(self):
-        while self._pipe.poll():
-            self._readings = self._pipe.recv()
-        return self._readings
+        '''Return the latest reading, as a Reading.'''
+        slot = self._slot
+        while True:
+            counter = slot[_COUNTER]
+            if counter % 2:
+                continue  # being written; will be done in a moment
+            reading = Reading(int(counter) // 2, slot[_TIME], slot[_TEMP], int(slot[_LUX]))
+            if slot[_COUNTER] == counter:
+                return reading
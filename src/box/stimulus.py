@@ -1,12 +1,13 @@
 import abc
 import atexit
+import logging
 import multiprocessing
 import os
 import signal
 import sys
 import time
-from threading import Timer
 
+from box import timing
 from box import wiring
 
 
@@ -14,36 +15,107 @@ _LIGHT_PWM_PIN = 18         # pin for PWM control of visible light bar
 _ELECTRIC_STIM_PIN = 25     # pin for enabling/disabling the electric current stimulation
 _ELECTRIC_AC_PIN = 8        # pin for alternating the "direction" of the stimulus (when using AlternatingElectricalStimulus)
 
+# pipe.poll() only waits in whole milliseconds (rounded up), so the stimulus
+# loop sleeps through the last _POLL_MARGIN seconds before a deadline instead.
+_POLL_MARGIN = 0.002
+
 
 class NotRootError(RuntimeError):
     pass
 
 
-# adapted from http://stackoverflow.com/a/16148744
 class Watchdog:
-    def __init__(self, timeout, pipe):  # timeout in seconds
+    '''Expires timeout seconds after it is started unless stopped first.
+
+    Just a deadline on the monotonic clock, checked by the stimulus loop
+    (which also wakes up for it; see remaining()), so starting and stopping
+    it costs nothing.
+    '''
+    def __init__(self, timeout):  # timeout in seconds
         self._timeout = timeout
-        self._pipe = pipe
-        self._timer = None
+        self._deadline = None
 
     def stop(self):
-        if self._timer:
-            self._timer.cancel()
-            self._timer = None
-
-    def start(self):
-        self._timer = Timer(self._timeout, self._triggered)
-        self._timer.start()
+        self._deadline = None
 
     def poke(self):
         """Start the timer if it is not already started; else let it run."""
-        if self._timer is None:
-            self.start()
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self._timeout
+
+    def remaining(self):
+        '''Seconds until the watchdog expires, or None if it isn't running.'''
+        if self._deadline is None:
+            return None
+        return max(0, self._deadline - time.monotonic())
+
+    def expired(self):
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
 
-    def _triggered(self):
-        self._pipe.send("timeout")
+class DutyCycle(object):
+    '''Timing of a stimulus toggled on and off at a fixed frequency.
+
+    Every toggle has an absolute deadline on the monotonic clock, computed
+    from the start of the stimulus (the n-th cycle starts at start +
+    n*period), so a late toggle shortens the following half-cycle rather
+    than delaying every later one, and the frequency does not drift.  If
+    toggling falls more than a whole cycle behind, the missed cycles are
+    skipped rather than run in a burst.  The lateness of every toggle is
+    recorded in a LatencyHistogram (jitter).
+    '''
+    def __init__(self, on_interval, off_interval):
+        self._on_interval = on_interval
+        self._period = on_interval + off_interval
+        self.jitter = timing.LatencyHistogram()
+        self.skipped = 0  # cycles skipped
         self.stop()
 
+    @property
+    def running(self):
+        return self._start is not None
+
+    def start(self, now):
+        '''Start the first cycle (in its "on" half) at now.'''
+        self._start = now
+        self._cycle = 0
+        self.pin_on = True
+        self._deadline = now + self._on_interval
+
+    def stop(self):
+        self._start = None
+        self._deadline = None
+        self.pin_on = False
+
+    def time_remaining(self, now):
+        '''Seconds until the next toggle, or None if not running.'''
+        if self._deadline is None:
+            return None
+        return max(0, self._deadline - now)
+
+    def update(self, now):
+        '''Toggle pin_on if its deadline has passed.'''
+        if self._deadline is None or now < self._deadline:
+            return
+        self.jitter.add(now - self._deadline)
+        if self.pin_on:
+            self.pin_on = False
+            self._deadline = self._start + (self._cycle + 1) * self._period
+        else:
+            self._cycle += 1
+            behind = int((now - self._start) / self._period) - self._cycle
+            if behind > 0:
+                self._cycle += behind
+                self.skipped += behind
+            self.pin_on = True
+            self._deadline = self._start + self._cycle * self._period + self._on_interval
+
+    def log(self):
+        stats = self.jitter.summary()
+        if stats['count']:
+            logging.info("Stimulus: %d toggles (%d cycles skipped); lateness (ms): mean %0.3f, p50 %0.3f, p95 %0.3f, p99 %0.3f, max %0.3f",
+                         stats['count'], self.skipped, stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max'])
+
 
 class StimulusBase(object):
     __metaclass__ = abc.ABCMeta
@@ -57,21 +129,56 @@ class StimulusBase(object):
         pass
 
     @abc.abstractmethod
-    def show(self, stimulus):
+    def show(self, stimulus, frame_time=None):
+        '''Show the given stimulus (0 or None for none), in response to the
+        frame captured at frame_time (on the time.monotonic() clock).'''
         pass
 
     def msg_poll(self):
         '''By default, Stimulus objects produce no messages unless this is overridden.'''
         return None
 
+    def record_latency(self, filename, starttime):
+        '''Record the latency of each change of the stimulus to the given
+        file, if supported (see ThreadedStimulus.record_latency()).'''
+        pass
+
+    def latency_summary(self):
+        '''Summary statistics (see timing.LatencyHistogram.summary()) of the
+        latency from frame capture to stimulus change, available after
+        end(), or None if not recorded.'''
+        return None
+
 
 class ThreadedStimulus(StimulusBase):
+    '''A stimulus run in a separate process.
+
+    The stimulus currently requested by show() is kept in shared memory, and
+    show() only sends a message (to wake the stimulus process) when it
+    changes, so nothing crosses the process boundary for the many frames on
+    which the stimulus stays the same.  Each message carries the time it was
+    sent, and the stimulus process records how long each change took to
+    reach it (see _handle_messages() and _log_latency()).
+
+    The stimulus process also records the end-to-end latency of each change
+    of the stimulus: from the capture of the frame that prompted it to the
+    actual change (see _record_latency()).
+    '''
     __metaclass__ = abc.ABCMeta
 
     @abc.abstractmethod  # must be overridden, but should be called via super()
     def __init__(self):
         self._child_pipe, self._pipe = multiprocessing.Pipe(duplex=True)
         self._p = None  # the separate process running the stimulus thread
+        self._state = multiprocessing.RawValue('d', 0.0)  # current stimulus (0 = none)
+        self._state_time = multiprocessing.RawValue('d', float('nan'))  # capture time of the frame that prompted it
+        self._shown = 0  # last stimulus passed to show(), in this process
+        self._latency_stats = None  # end-to-end latency, from the stimulus process at the end
+        # in the stimulus process
+        self._latency = timing.LatencyHistogram()  # command delivery
+        self._e2e_latency = timing.LatencyHistogram()  # frame capture to stimulus change
+        self._latencyfile = None
+        self._starttime = None
 
     @abc.abstractmethod  # must be overridden
     def _stimulus_thread(self, pipe):
@@ -83,19 +190,95 @@ class ThreadedStimulus(StimulusBase):
         atexit.register(self.end)
 
     def end(self):
+        p, self._p = self._p, None  # may be called both directly and at exit
+        if p is None:
+            return
         self._pipe.send('end')
-        # clear queue before joining
-        while self._pipe.poll():
-            self._pipe.recv()
-        self._p.join()
-
-    def show(self, stimulus):
-        self._pipe.send(stimulus)
+        # clear queue before joining (keeping the latency stats sent at the end)
+        while p.is_alive() or self._pipe.poll():
+            if self._pipe.poll(0.01):
+                self._recv()
+        p.join()
+
+    def show(self, stimulus, frame_time=None):
+        stimulus = stimulus or 0  # None = no stimulus as well
+        if stimulus == self._shown:
+            return
+        self._shown = stimulus
+        self._state_time.value = frame_time if frame_time is not None else float('nan')
+        self._state.value = stimulus
+        self._pipe.send(('change', time.monotonic()))
+
+    def record_latency(self, filename, starttime):
+        '''Write a line to the given (CSV) file for each change of the
+        stimulus: the capture time of the frame that prompted it (in seconds
+        since starttime, as in the track file), the stimulus level it
+        changed to, and the latency from capture to the change in ms.'''
+        self._pipe.send(('record', filename, starttime))
+
+    def latency_summary(self):
+        return self._latency_stats
+
+    def _recv(self):
+        '''Receive a message from the stimulus process, keeping the latency
+        stats it sends at the end rather than returning them.'''
+        msg = self._pipe.recv()
+        if isinstance(msg, tuple) and msg[0] == 'latency':
+            self._latency_stats = msg[1]
+            return None
+        return msg
+
+    def _handle_messages(self, pipe, timeout):
+        '''In the stimulus process: wait up to timeout seconds (None = no
+        limit) for messages, and handle all that are waiting.  Returns
+        'end' if the stimulus should end, 'change' if the requested stimulus
+        changed (read it from self._state), or None.'''
+        result = None
+        msg_ready = pipe.poll(timeout)
+        while msg_ready:
+            msg = pipe.recv()
+            if msg == 'end':
+                return msg
+            elif msg[0] == 'record':
+                _, filename, self._starttime = msg
+                self._latencyfile = open(filename, 'w')
+            else:
+                # ('change', time sent): several changes may be waiting, but
+                # only the latest state (in self._state) matters.
+                self._latency.add(time.monotonic() - msg[1])
+                result = 'change'
+            msg_ready = pipe.poll()  # no timeout, return immediately inside loop
+        return result
+
+    def _record_latency(self, frame_time, level):
+        '''In the stimulus process: record that the stimulus has just
+        changed to level in response to the frame captured at frame_time.'''
+        if frame_time != frame_time:
+            return  # NaN: no frame time given
+        latency = time.monotonic() - frame_time
+        self._e2e_latency.add(latency)
+        if self._latencyfile is not None:
+            self._latencyfile.write("%0.4f,%s,%0.3f\n" % (frame_time - self._starttime, level, 1000 * latency))
+            self._latencyfile.flush()
+
+    def _log_latency(self, pipe):
+        '''In the stimulus process, at the end: log the latency stats, and
+        send the end-to-end stats to the main process.'''
+        stats = self._latency.summary()
+        if stats['count']:
+            logging.info("Stimulus: %d changes; delay reaching stimulus process (ms): mean %0.3f, p50 %0.3f, p95 %0.3f, p99 %0.3f, max %0.3f",
+                         stats['count'], stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max'])
+        stats = self._e2e_latency.summary()
+        if stats['count']:
+            logging.info("Stimulus: %d changes; latency from frame capture (ms): mean %0.3f, p50 %0.3f, p95 %0.3f, p99 %0.3f, max %0.3f",
+                         stats['count'], stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max'])
+        pipe.send(('latency', stats))
+        if self._latencyfile is not None:
+            self._latencyfile.close()
 
     def msg_poll(self):
         if self._pipe.poll():
-            response = self._pipe.recv()
-            return response
+            return self._recv()
         return None
 
 
@@ -109,7 +292,7 @@ class DummyStimulus(StimulusBase):
     def end(self):
         print("Dummy: end()")
 
-    def show(self, stimulus):
+    def show(self, stimulus, frame_time=None):
         if stimulus:
             print("Dummy: stimulus %5d: %s" % (self._stimcount, str(stimulus)))
             self._stimcount += 1
@@ -147,21 +330,18 @@ class GPIOStimulus(ThreadedStimulus):
             self._pwm = False
 
         if freq_Hz is None or freq_Hz == 0:
-            self._on_interval = None  # infinite wait in poll()
-            self._off_interval = None  # infinite wait in poll()
+            self._duty_cycle = None  # pin stays on while stimulus is active
         else:
-            self._on_interval = 1.0 / freq_Hz * duty_cycle
-            self._off_interval = 1.0 / freq_Hz * (1 - duty_cycle)
+            self._duty_cycle = DutyCycle(1.0 / freq_Hz * duty_cycle, 1.0 / freq_Hz * (1 - duty_cycle))
 
         if safety_limit is not None:
-            self._watchdog = Watchdog(safety_limit, self._pipe)
+            self._watchdog = Watchdog(safety_limit)
         else:
             self._watchdog = None
 
         self._stim_active = False   # is stimulus activated?
-        self._pin_on = False        # is stimulus pin currently on? (may be off while 'activated' if freq_Hz>0)
         self._pinval = None         # current PWM value to avoid extraneous pwmWrites
-        self._stim_cycle_end = None  # end of current half-cycle (on/off) of stimulus
+        self._command_time = None   # capture time of the frame prompting a command not yet applied to the pin
 
     def _set_pin(self, val):
         if self._pinval != val:
@@ -170,6 +350,9 @@ class GPIOStimulus(ThreadedStimulus):
             else:
                 wiring.out(self._pin, val)
             self._pinval = val
+            if self._command_time is not None:
+                self._record_latency(self._command_time, val)
+                self._command_time = None
 
     def _pin_nostim(self):
         if self._pwm:
@@ -189,28 +372,30 @@ class GPIOStimulus(ThreadedStimulus):
         if self._watchdog:
             self._watchdog.poke()
 
-    def _handle_command(self, cmd):
+    def _handle_command(self, cmd, frame_time):
+        self._command_time = frame_time
         if cmd:
             self._stim_active = True
         else:
             self._stim_active = False
-            self._pin_on = False
-            self._stim_cycle_end = None  # so next activation starts in On phase of cycle
+            if self._duty_cycle:
+                self._duty_cycle.stop()  # so next activation starts in On phase of cycle
 
     def _update(self):
         if self._stim_active:
-            if self._on_interval is None:
+            if self._duty_cycle is None:
                 self._pin_stim()
             else:
-                # check and possibly toggle stimulus pin on/off
-                if self._time_remaining() == 0:
-                    self._pin_on = not self._pin_on
-                    duration = self._on_interval if self._pin_on else self._off_interval
-                    self._stim_cycle_end = time.time() + duration
-                    if self._pin_on:
-                        self._pin_stim()
-                    else:
-                        self._pin_nostim()
+                # start the cycle or possibly toggle stimulus pin on/off
+                now = time.monotonic()
+                if self._duty_cycle.running:
+                    self._duty_cycle.update(now)
+                else:
+                    self._duty_cycle.start(now)
+                if self._duty_cycle.pin_on:
+                    self._pin_stim()
+                else:
+                    self._pin_nostim()
         else:
             self._pin_nostim()
 
@@ -221,11 +406,14 @@ class GPIOStimulus(ThreadedStimulus):
         self._set_pin(0)
 
     def _time_remaining(self):
-        if self._on_interval is None:
-            return None  # use infinite timeout in pipe.poll()
-        if self._stim_cycle_end is None:
-            return 0     # done; time to toggle
-        return max(0, self._stim_cycle_end - time.time())
+        '''Seconds until the next toggle or watchdog expiry, whichever is
+        first, or None (an infinite timeout in pipe.poll()) for neither.'''
+        remaining = [
+            self._duty_cycle and self._duty_cycle.time_remaining(time.monotonic()),
+            self._watchdog and self._watchdog.remaining(),
+        ]
+        remaining = [r for r in remaining if r is not None]
+        return min(remaining) if remaining else None
 
     def _stimulus_thread(self, pipe):
         # ignore signals that will be handled by parent
@@ -236,23 +424,30 @@ class GPIOStimulus(ThreadedStimulus):
 
         while True:
             # check pipe for commands and implement delay between flashes
-            msg_ready = pipe.poll(self._time_remaining())
-            while msg_ready:
-                val = pipe.recv()
+            timeout = self._time_remaining()
+            if timeout is not None and timeout < _POLL_MARGIN:
+                time.sleep(timeout)
+                timeout = 0
+            elif timeout is not None:
+                timeout -= _POLL_MARGIN
+            msg = self._handle_messages(pipe, timeout)
+            if msg == 'end':
+                self._end()
+                break
+            elif msg == 'change':
+                self._handle_command(self._state.value, self._state_time.value)
 
-                if val == 'end' or val is None:
-                    self._end()
-                    return
-                elif val == 'timeout':
-                    pipe.send('safety limit reached')
-                    self._end()
-                    return
-
-                self._handle_command(val)
+            self._update()
+            self._command_time = None  # if the command didn't change the pin
 
-                msg_ready = pipe.poll()  # no timeout, return immediately inside loop
+            if self._watchdog and self._watchdog.expired():
+                pipe.send('safety limit reached')
+                self._end()
+                break
 
-            self._update()
+        if self._duty_cycle:
+            self._duty_cycle.log()
+        self._log_latency(pipe)
 
 
 class LightBarStimulus(GPIOStimulus):
@@ -0,0 +1,106 @@
+import json
+import logging
+import math
+import os
+import time
+
+import numpy
+
+
+class LatencyHistogram(object):
+    '''Counts of durations in fixed, logarithmically-spaced buckets.
+
+    Bucket i holds durations up to MIN_MS * 2**((i+1)/BUCKETS_PER_DOUBLING)
+    milliseconds, so percentiles are reported with at most ~19% error while
+    recording a duration costs just a log and an increment.
+    '''
+    MIN_MS = 0.01
+    BUCKETS_PER_DOUBLING = 4
+    NUM_BUCKETS = 80   # up to ~10s; anything longer goes in the last bucket
+
+    def __init__(self):
+        self._counts = numpy.zeros(self.NUM_BUCKETS, dtype=numpy.int64)
+        self._total = 0.0
+        self._max = 0.0
+
+    def add(self, seconds):
+        ms = 1000 * seconds
+        if ms <= self.MIN_MS:
+            index = 0
+        else:
+            index = min(int(self.BUCKETS_PER_DOUBLING * math.log2(ms / self.MIN_MS)), self.NUM_BUCKETS - 1)
+        self._counts[index] += 1
+        self._total += ms
+        if ms > self._max:
+            self._max = ms
+
+    @property
+    def count(self):
+        return int(self._counts.sum())
+
+    def _bucket_limit(self, index):
+        return self.MIN_MS * 2 ** ((index + 1) / float(self.BUCKETS_PER_DOUBLING))
+
+    def percentile(self, p):
+        '''Return the upper limit (in ms) of the bucket holding the p-th percentile.'''
+        count = self.count
+        if count == 0:
+            return None
+        index = numpy.searchsorted(numpy.cumsum(self._counts), count * p / 100.0)
+        return min(self._bucket_limit(index), self._max)
+
+    def summary(self):
+        count = self.count
+        if count == 0:
+            return {'count': 0}
+        return {
+            'count': count,
+            'mean': self._total / count,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self._max,
+        }
+
+
+class StageTimer(object):
+    '''Records the time spent in each stage of a loop.
+
+    Call start() at the top of the loop, then lap(stage) at the end of each
+    stage to record the time since the previous start() or lap().  Stages
+    are reported in the order given in stages, then in the order first seen.
+    '''
+    def __init__(self, stages=()):
+        # stage name -> LatencyHistogram
+        self._hists = {stage: LatencyHistogram() for stage in stages}
+        self._last = None
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        hist = self._hists.get(stage)
+        if hist is None:
+            hist = self._hists[stage] = LatencyHistogram()
+        hist.add(now - self._last)
+        self._last = now
+
+    def summary(self):
+        '''Return {stage: {count, mean, p50, p95, p99, max}}, times in ms.'''
+        return {stage: hist.summary() for stage, hist in self._hists.items()}
+
+    def log(self):
+        logging.info("Stage timing (ms):         mean     p50     p95     p99     max")
+        for stage, stats in self.summary().items():
+            if stats['count']:
+                logging.info("  %-21s %7.2f %7.2f %7.2f %7.2f %7.2f", stage,
+                             stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max'])
+
+    def write(self, path):
+        '''Write the current summary to a JSON file, replacing it atomically
+        so a reader never sees a partial file.'''
+        tmppath = "%s.tmp" % path
+        with open(tmppath, 'w') as f:
+            json.dump({'time': time.time(), 'stages': self.summary()}, f)
+        os.replace(tmppath, path)
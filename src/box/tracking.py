@@ -5,37 +5,99 @@ import numpy
 import os
 import subprocess
 import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 class TargetFilterBase(object):
-    def __init__(self):
+    def __init__(self, reuse_buffers=True):
         self._cache = (None, None)
 
+        # If reuse_buffers is set, each filter writes its outputs into
+        # buffers it owns (allocated on first use, one per name and shape)
+        # rather than allocating new arrays for every frame.
+        self._reuse_buffers = reuse_buffers
+        self._buffers = {}
+
+        # Region of interest (x1, y1, x2, y2) within each frame, if only
+        # part of the frame should be processed (None = entire frame).
+        self._roi = None
+
     def __call__(self, frame):
         '''Simple caching around a _do_filter method defined in subclasses.'''
         if frame is self._cache[0]:
             return self._cache[1]
 
+        region = frame
+        if self._roi is not None:
+            x1, y1, x2, y2 = self._roi
+            region = frame[y1:y2, x1:x2]
+
         # apply filter to a copy of the frame's data, as it may modify it
-        filtered = self._do_filter(frame[:])
+        filtered = self._do_filter(region[:])
         self._cache = (frame, filtered)
         return filtered
 
-    def __and__(self, other):
-        '''Return a callable that produces the Boolean AND of the
-        filtered frames produced by calling self and other on the input.'''
+    def set_roi(self, roi):
+        '''Restrict filtering of following frames to the given region,
+        (x1, y1, x2, y2) in pixel coordinates, or None for the entire frame.
+        Filtered outputs will be the size of the region.'''
+        self._roi = roi
+        self._cache = (None, None)
+
+    def _buffer(self, name, shape, dtype=numpy.uint8):
+        '''Return this filter's output buffer with the given name and shape.
+
+        Returns None if not reusing buffers, which can be passed as the dst
+        of any OpenCV function to have it allocate a new output instead.
+        '''
+        if not self._reuse_buffers:
+            return None
+        key = (name, shape)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = numpy.empty(shape, dtype)
+            self._buffers[key] = buf
+        return buf
+
+    def _filled(self, name, like, value):
+        '''Return an array of the same shape and type as like, filled with value.'''
+        buf = self._buffer(name, like.shape, like.dtype)
+        if buf is None:
+            return numpy.full_like(like, value)
+        buf.fill(value)
+        return buf
+
+    def _combine(self, other, op):
+        buffers = {}
+
         def filter_frame(frame):
-            return self(frame) & other(frame)
+            first = self(frame)
+            second = other(frame)
+            if not self._reuse_buffers:
+                return op(first, second)
+            # one output buffer per combination (and per shape)
+            out = buffers.get(first.shape)
+            if out is None:
+                out = buffers[first.shape] = numpy.empty_like(first)
+            return op(first, second, out=out)
 
         return filter_frame
 
+    def __and__(self, other):
+        '''Return a callable that produces the Boolean AND of the
+        filtered frames produced by calling self and other on the input.'''
+        return self._combine(other, numpy.bitwise_and)
+
     def __or__(self, other):
         '''Return a callable that produces the Boolean OR of the
         filtered frames produced by calling self and other on the input.'''
-        def filter_frame(frame):
-            return self(frame) | other(frame)
-
-        return filter_frame
+        return self._combine(other, numpy.bitwise_or)
 
 
 class TargetFilterDistance(TargetFilterBase):
@@ -44,8 +106,8 @@ class TargetFilterDistance(TargetFilterBase):
     combined with another filter to limit the distance from the last estimate that
     it will "consider."
     '''
-    def __init__(self, tracker, maxdist):
-        super(TargetFilterDistance, self).__init__()
+    def __init__(self, tracker, maxdist, reuse_buffers=True):
+        super(TargetFilterDistance, self).__init__(reuse_buffers)
 
         self._tracker = tracker
         self._maxdist = maxdist
@@ -53,20 +115,23 @@ class TargetFilterDistance(TargetFilterBase):
     def _do_filter(self, frame):
         ''' "Process" (really "draw" in this case) a single frame. '''
         pos = self._tracker.position_pixel
+        if self._roi is not None and not any(x is None for x in pos):
+            # shift position into the region's coordinates
+            pos = (pos[0] - self._roi[0], pos[1] - self._roi[1])
         if any(x is None for x in pos):
             # no position, so return a filled frame (any position is okay)
-            ret = numpy.ones_like(frame)
+            ret = self._filled('dist', frame, 1)
         else:
             # black w/ white circle around position estimate
-            ret = numpy.zeros_like(frame)
+            ret = self._filled('dist', frame, 0)
             cv2.circle(ret, pos, self._maxdist, color=(255,255,255), thickness=-1)  # thickness=-1 -> filled circle
 
         return ret
 
 
 class TargetFilterBrightness(TargetFilterBase):
-    def __init__(self):
-        super(TargetFilterBrightness, self).__init__()
+    def __init__(self, reuse_buffers=True):
+        super(TargetFilterBrightness, self).__init__(reuse_buffers)
 
         # elements to reuse in erode/dilate
         # CROSS elimates more horizontal/vertical lines and leaves more
@@ -76,8 +141,13 @@ class TargetFilterBrightness(TargetFilterBase):
 
     def _do_filter(self, frame):
         ''' Process a single frame. '''
+        # Outputs alternate between two buffers: no OpenCV function here
+        # has to write into its own input.
+        buf_a = self._buffer('a', frame.shape)
+        buf_b = self._buffer('b', frame.shape)
+
         # blur to reduce noise
-        frame = cv2.GaussianBlur(frame, (5, 5), 0, borderType=cv2.BORDER_CONSTANT)
+        frame = cv2.GaussianBlur(frame, (5, 5), 0, dst=buf_a, borderType=cv2.BORDER_CONSTANT)
 
         # threshold to find contiguous regions of "bright" pixels
         # ignore all "dark" (<1/8 max) pixels
@@ -87,20 +157,20 @@ class TargetFilterBrightness(TargetFilterBase):
         if max == min:
             return frame
         threshold = min + (max - min) / 8
-        _, frame = cv2.threshold(frame, threshold, 255, cv2.THRESH_BINARY)
+        _, frame = cv2.threshold(frame, threshold, 255, cv2.THRESH_BINARY, dst=buf_b)
 
         # filter out single pixels and other noise
-        frame = cv2.erode(frame, self._element_shrink)
+        frame = cv2.erode(frame, self._element_shrink, dst=buf_a)
 
         # restore and join nearby regions (in case one fish has a skinny middle...)
-        frame = cv2.dilate(frame, self._element_grow)
+        frame = cv2.dilate(frame, self._element_grow, dst=buf_b)
 
         return frame
 
 
 class TargetFilterBGSub(TargetFilterBase):
-    def __init__(self):
-        super(TargetFilterBGSub, self).__init__()
+    def __init__(self, reuse_buffers=True):
+        super(TargetFilterBGSub, self).__init__(reuse_buffers)
 
         # background subtractor
         #self._bgs = cv2.BackgroundSubtractorMOG()
@@ -119,6 +189,18 @@ class TargetFilterBGSub(TargetFilterBase):
         # takes a bit of time to learn the background initially.
         self._learning_rate = 0.001
 
+        # When filtering only a region of interest, the model is not updated.
+        # Instead, foreground is found by comparing the region to the model's
+        # background image (cached here), and the model is caught up on the
+        # next full frame with a correspondingly larger learning rate.
+        self._background = None
+        self._frames_since_update = 0
+
+        # Threshold on the absolute difference from the background image in
+        # a region of interest: approximates MOG2's per-pixel test
+        # (dist^2 < varThreshold * var) using its initial variance.
+        self._roi_threshold = (self._bgs.getVarThreshold() * self._bgs.getVarInit()) ** 0.5
+
         # elements to reuse in erode/dilate
         # CROSS elimates more horizontal/vertical lines and leaves more
         # blobs with extent in both axes [than RECT].
@@ -127,37 +209,171 @@ class TargetFilterBGSub(TargetFilterBase):
 
     def _do_filter(self, frame):
         ''' Process a single frame. '''
+        buf_a = self._buffer('a', frame.shape)
+        buf_b = self._buffer('b', frame.shape)
+
+        self._frames_since_update += 1
+
         # subtract background, clean up image
-        mask = self._bgs.apply(frame, learningRate=self._learning_rate)
+        if self._roi is None:
+            learning_rate = min(1.0, self._learning_rate * self._frames_since_update)
+            mask = self._bgs.apply(frame, fgmask=buf_a, learningRate=learning_rate)
+            self._frames_since_update = 0
+            self._background = None  # model has changed
+        else:
+            if self._background is None:
+                self._background = self._bgs.getBackgroundImage()
+            x1, y1, x2, y2 = self._roi
+            diff = cv2.absdiff(frame, self._background[y1:y2, x1:x2], dst=buf_b)
+            _, mask = cv2.threshold(diff, self._roi_threshold, 255, cv2.THRESH_BINARY, dst=buf_a)
 
         # filter out single pixels
-        mask = cv2.erode(mask, self._element_shrink)
+        mask = cv2.erode(mask, self._element_shrink, dst=buf_b)
 
         # restore and join nearby regions (in case one fish has a skinny middle...)
-        mask = cv2.dilate(mask, self._element_grow)
+        mask = cv2.dilate(mask, self._element_grow, dst=buf_a)
 
         return mask
 
 
+class TargetFilterRunningBG(TargetFilterBase):
+    '''Background subtraction against a single background image, much
+    cheaper per frame than MOG2's per-pixel mixture model.  Suited to a
+    static camera and steady (IR) lighting.
+
+    method:
+      'average': the background is a running average of the frames
+                 (cv2.accumulateWeighted), each new frame weighted by
+                 learning_rate.
+      'median':  the background is an approximate running median, kept in
+                 integers: each pixel moves one gray level toward the frame
+                 once every 1/learning_rate frames.
+    For the first 1/learning_rate frames, the background learns faster (a
+    plain average of the frames so far, or one gray level every frame), so
+    it is usable soon after the start.
+
+    Pixels differing from the background by more than threshold gray levels
+    are foreground.  As with TargetFilterBGSub, a region of interest is only
+    compared to the background, and the model catches up on the next full
+    frame.
+    '''
+    def __init__(self, method='average', learning_rate=0.001, threshold=11, reuse_buffers=True):
+        super(TargetFilterRunningBG, self).__init__(reuse_buffers)
+        if method not in ('average', 'median'):
+            raise ValueError("Unknown background model: %s" % method)
+        self._update = self._update_average if method == 'average' else self._update_median
+        self._learning_rate = learning_rate
+        self._threshold = threshold
+        self._warmup = int(round(1.0 / learning_rate))
+
+        self._average = None  # float32 accumulator, for 'average'
+        self._background = None  # uint8 background image
+        self._frames = 0  # number of full frames learned from
+        self._frames_since_update = 0
+        self._pending_steps = 0.0  # for 'median': fraction of a gray level not yet moved
+
+        # elements to reuse in erode/dilate (as in TargetFilterBGSub)
+        self._element_shrink = cv2.getStructuringElement(cv2.MORPH_CROSS,(5,5))
+        self._element_grow = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(7,7))
+
+    def _update_average(self, frame, frames):
+        if self._frames <= self._warmup:
+            rate = 1.0 / self._frames  # mean of the frames so far
+        else:
+            rate = min(1.0, self._learning_rate * frames)
+        cv2.accumulateWeighted(frame, self._average, rate)
+        cv2.convertScaleAbs(self._average, dst=self._background)
+
+    def _update_median(self, frame, frames):
+        if self._frames <= self._warmup:
+            steps = frames
+        else:
+            self._pending_steps += self._learning_rate * frames
+            steps = int(self._pending_steps)
+            self._pending_steps -= steps
+            if not steps:
+                return
+        # move toward the frame by up to steps: clip the frame to within
+        # steps of the background (with saturating arithmetic)
+        steps = min(steps, 255)
+        low = cv2.subtract(self._background, steps, dst=self._buffer('low', frame.shape))
+        high = cv2.add(self._background, steps, dst=self._buffer('high', frame.shape))
+        cv2.min(cv2.max(frame, low, dst=low), high, dst=self._background)
+
+    def _do_filter(self, frame):
+        ''' Process a single frame. '''
+        buf_a = self._buffer('a', frame.shape)
+        buf_b = self._buffer('b', frame.shape)
+
+        self._frames_since_update += 1
+
+        if self._roi is None:
+            self._frames += 1
+            if self._background is None:
+                self._background = frame.copy()
+                self._average = frame.astype(numpy.float32)
+            else:
+                self._update(frame, self._frames_since_update)
+            self._frames_since_update = 0
+            background = self._background
+        else:
+            x1, y1, x2, y2 = self._roi
+            background = self._background[y1:y2, x1:x2]
+
+        # subtract background, clean up image
+        diff = cv2.absdiff(frame, background, dst=buf_b)
+        _, mask = cv2.threshold(diff, self._threshold, 255, cv2.THRESH_BINARY, dst=buf_a)
+
+        # filter out single pixels
+        mask = cv2.erode(mask, self._element_shrink, dst=buf_b)
+
+        # restore and join nearby regions (in case one fish has a skinny middle...)
+        mask = cv2.dilate(mask, self._element_grow, dst=buf_a)
+
+        return mask
+
+
+def make_bgsub_filter(tracking_conf=None, reuse_buffers=True):
+    '''Create the background subtraction filter selected in the [tracking]
+    section of the configuration (as a dict): bgsub = mog2 (the default;
+    TargetFilterBGSub) or average or median (TargetFilterRunningBG, with
+    bgsub_learning_rate and bgsub_threshold).'''
+    tracking_conf = tracking_conf or {}
+    method = tracking_conf.get('bgsub', 'mog2')
+    if method == 'mog2':
+        return TargetFilterBGSub(reuse_buffers=reuse_buffers)
+    return TargetFilterRunningBG(
+        method,
+        learning_rate=tracking_conf.get('bgsub_learning_rate', 0.001),
+        threshold=tracking_conf.get('bgsub_threshold', 11),
+        reuse_buffers=reuse_buffers,
+    )
+
+
 class FrameProcessor(object):
     def __init__(self):
         # most recent frame and its contours and centroids
         self._frame = None
+        self._offset = (0, 0)
         self._contours = None
         self._centroids = None
 
-    def new_frame(self, frame):
+    def new_frame(self, frame, offset=(0, 0)):
+        '''Set the frame to process.  offset is the position of the frame within
+        the full tank view, added to all contours and centroids (used when the
+        frame is just a region of interest).'''
         self._frame = frame
+        self._offset = offset
         # reset contours and centroids
         self._contours = None
         self._centroids = None
 
     def _get_contours(self):
         # find contours
-        _, self._contours, _ = cv2.findContours(self._frame, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        _, self._contours, _ = cv2.findContours(self._frame, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=self._offset)
 
     def _get_centroids(self):
-        if not self._contours:
+        if self._contours is None:
             self._get_contours()
 
         self._centroids = []
@@ -171,31 +387,129 @@ class FrameProcessor(object):
 
     @property
     def contours(self):
-        if not self._contours:
+        if self._contours is None:
             self._get_contours()
 
         return self._contours
 
     @property
     def centroids(self):
-        if not self._centroids:
+        if self._centroids is None:
             self._get_centroids()
 
         return self._centroids
 
 
+class ComponentFrameProcessor(FrameProcessor):
+    '''Finds detections as the connected components of each frame, with a
+    single OpenCV call rather than per-contour moments.  Centroids, areas, and
+    bounding boxes are all numpy arrays (one row per detection), and contours
+    are only found if something asks for them (e.g., the --watch window).
+
+    Components with an area (in pixels) below min_area or above max_area are
+    dropped.  The default min_area, 3, drops components of 1 or 2 pixels,
+    whose contours have zero area, so FrameProcessor skips them too.  The two
+    still differ on components that are thin lines (zero contour area, so
+    skipped by FrameProcessor, however long) and on components with holes:
+    FrameProcessor's RETR_EXTERNAL contours enclose any holes, so its
+    centroids include them, while a component's centroid and area count only
+    its own pixels.
+    '''
+    def __init__(self, min_area=3, max_area=None):
+        super(ComponentFrameProcessor, self).__init__()
+        self._min_area = min_area
+        self._max_area = max_area
+        self._areas = None
+        self._bboxes = None
+        self._labels = None  # reused label image
+
+    def new_frame(self, frame, offset=(0, 0)):
+        super(ComponentFrameProcessor, self).new_frame(frame, offset)
+        self._areas = None
+        self._bboxes = None
+
+    def _get_centroids(self):
+        if self._labels is None or self._labels.shape != self._frame.shape:
+            self._labels = numpy.empty(self._frame.shape, numpy.int32)
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(self._frame, labels=self._labels, connectivity=8)
+
+        # label 0 is the background
+        stats = stats[1:]
+        areas = stats[:, cv2.CC_STAT_AREA]
+        keep = areas >= self._min_area
+        if self._max_area is not None:
+            keep &= areas <= self._max_area
+
+        self._centroids = centroids[1:][keep] + self._offset
+        self._areas = areas[keep]
+        self._bboxes = stats[keep, :4]  # x, y, width, height
+        self._bboxes[:, :2] += self._offset
+
+    @property
+    def areas(self):
+        if self._areas is None:
+            self._get_centroids()
+
+        return self._areas
+
+    @property
+    def bboxes(self):
+        if self._bboxes is None:
+            self._get_centroids()
+
+        return self._bboxes
+
+
+class PositionHistory(object):
+    '''A fixed-capacity history of (x, y) integer pixel positions.
+
+    Positions are stored twice, in both halves of an array of 2*capacity rows,
+    so the most recent positions are always contiguous and can be returned as
+    a view rather than a copy.
+    '''
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._data = numpy.zeros((2*capacity, 2), numpy.int32)
+        self._next = 0   # row of next write, in the first half
+        self._count = 0  # number of positions stored (up to capacity)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, pt):
+        self._data[self._next] = pt
+        self._data[self._next + self._capacity] = pt
+        self._next = (self._next + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    def last(self, n=None):
+        '''Return a view of the n most recent positions (default: all
+        stored), oldest first, as an (n,2) array.'''
+        if n is None or n > self._count:
+            n = self._count
+        end = self._next + self._capacity
+        return self._data[end-n:end]
+
+
 class TrackerBase(object):
-    def __init__(self, w, h):
+    # min seconds between log messages about rejected points
+    _REJECT_LOG_INTERVAL = 10
+
+    def __init__(self, w, h, history=1000):
+        '''history: number of recent positions to keep (see positions)'''
         self._w = float(w)  # frame width (for scaling coordinates)
         self._h = float(h)  # frame height
         self._pos = numpy.array((None, None))
 
-        self._positions = []
+        self._positions = PositionHistory(history)
 
         # How many frames have we not had something to track?
         # Initialized to 100 so status() is initially 'lost'
         self._missing_count = 100
 
+        # rejected point counts since last logged, and time of last log message, per reason
+        self._rejections = {}
+
     @property
     def position_pixel(self):
         '''Return the position in integer pixel coordinates.'''
@@ -204,6 +518,11 @@ class TrackerBase(object):
         else:
             return tuple(self._pos)
 
+    @property
+    def position_predicted(self):
+        '''Return the predicted position for the next frame in integer pixel coordinates.'''
+        return self.position_pixel
+
     def _pixel_to_tank(self, pt):
         '''Transform pixel coordinates to tank coordinates.
         Both x- and y-coordinates are scaled to 0.0-1.0 relative to the view of the tank.
@@ -227,19 +546,35 @@ class TrackerBase(object):
 
     @property
     def positions(self):
-        return self._positions
+        '''Return a view of the most recent known positions (up to the
+        tracker's history length), oldest first, as an (n,2) array.'''
+        return self._positions.last()
 
     def _get_closest(self, obs):
-        if not obs:
+        if len(obs) == 0:
             return None
         else:
-            scored = [(self._score_point(pt), pt) for pt in obs]
-            closest = max(scored)
+            obs = numpy.asarray(obs, dtype=float).reshape(-1, 2)
+            scores = self._score_points(obs)
+            best = scores.max()
 
-            if closest[0] < 0:
+            if best < 0:
                 return None
 
-            return closest[1]
+            # break ties by largest x, then largest y coordinate
+            candidates = obs[scores == best]
+            return candidates[numpy.lexsort(candidates.T[::-1])[-1]]
+
+    def _log_rejection(self, reason, count, example):
+        '''Log rejected points, summarized to at most one message
+        per reason every _REJECT_LOG_INTERVAL seconds.'''
+        counts = self._rejections.setdefault(reason, [0, None])
+        counts[0] += count
+        now = time.monotonic()
+        if counts[1] is None or now - counts[1] >= self._REJECT_LOG_INTERVAL:
+            logging.info("%d point(s) rejected due to %s; latest: %s", counts[0], reason, example)
+            counts[0] = 0
+            counts[1] = now
 
     @property
     def status(self):
@@ -280,17 +615,21 @@ class SimpleTracker(TrackerBase):
     '''A simple tracking class.  Only ever reports last-known position.  No
     estimates/predictions.
     '''
-    def _score_point(self, pt):
-        '''Score a given detection point by its distance from the last known
+    def _score_points(self, pts):
+        '''Score detection points by their distance from the last known
         position of the fish.
 
+        Parameters:
+            pts: (N,2) array of points in pixel coordinates.
+
         Returns:
-            A floating point value between 0 and 1 indicating a score (1 is
-            highest/best score) or -1 if the point is determined to be invalid.
+            An array of N floating point values between 0 and 1 indicating each
+            point's score (1 is highest/best score) or -1 where the point is
+            determined to be invalid.
         '''
         if self._have_pos():
-            expected = self._pos
-            dist = numpy.linalg.norm(expected - pt)
+            expected = self._pos.astype(float)
+            dist = numpy.hypot(*(pts - expected).T)
 
             # If closest is farther away than we estimate the fish could be
             # (based on fish's max velocity and number of tracking-missing
@@ -298,16 +637,15 @@ class SimpleTracker(TrackerBase):
             # NOTE: based on a semi-magic number: max_dist_per_frame...
             max_dist_per_frame = 0.2 * self._w  # assume fish can't move more than 20% of tank in one frame time
             max_est_dist = (self._missing_count + 1) * max_dist_per_frame
-            if dist > max_est_dist:
-                # not considered a valid point
-                return -1
 
             # scale (dist==0)->1.0, (dist==inf)->0.0
-            score = 1.0 / (dist+1)
-            return score
+            scores = 1.0 / (dist+1)
+            # points too far away are not considered valid
+            scores[dist > max_est_dist] = -1
+            return scores
         else:
             # as good as any other, if we have no idea where the fish is to start
-            return 0
+            return numpy.zeros(len(pts))
 
     def _update_estimates(self, prevpos):
         # SimpleTracker has no estimates
@@ -316,23 +654,30 @@ class SimpleTracker(TrackerBase):
 
 class VelocityTracker(TrackerBase):
     '''A predictive tracking class.  Estimates position when fish is lost based on recent velocity.'''
-    def __init__(self, w, h):
-        super(VelocityTracker, self).__init__(w, h)
+    def __init__(self, w, h, history=1000):
+        super(VelocityTracker, self).__init__(w, h, history)
         self._vel = numpy.zeros(2)
 
-    def _score_point(self, pt):
-        '''Score a given detection point by its distance from the last known
-        position of the fish.
+    def _score_points(self, pts):
+        '''Score detection points by their distance from the predicted
+        position of the fish and the acceleration they would imply.
+
+        Parameters:
+            pts: (N,2) array of points in pixel coordinates.
 
         Returns:
-            A floating point value between 0 and 1 indicating a score (1 is
-            highest/best score) or -1 if the point is determined to be invalid.
+            An array of N floating point values between 0 and 1 indicating each
+            point's score (1 is highest/best score) or -1 where the point is
+            determined to be invalid.
         '''
         if self._have_pos():
+            # (_pos and _vel may hold Python objects; convert for fast math)
+            pos = self._pos.astype(float)
+            vel = self._vel.astype(float)
             # expect it continues moving with some fraction
             # of its previous velocity
-            expected = self._pos + self._vel * 0.5
-            dist = numpy.linalg.norm(expected - pt)
+            expected = pos + vel * 0.5
+            dist = numpy.hypot(*(pts - expected).T)
 
             # If closest is farther away than we estimate the fish could be
             # (based on fish's max velocity and number of tracking-missing
@@ -340,32 +685,40 @@ class VelocityTracker(TrackerBase):
             # NOTE: based on a semi-magic number: max_dist_per_frame...
             max_dist_per_frame = 0.3 * self._w  # assume fish can't move more than 30% of tank in one frame time
             max_est_dist = (self._missing_count + 1) * max_dist_per_frame
-            if dist > max_est_dist:
-                # not considered a valid point
-                logging.info("Point rejected due to distance: {pos: %s, dist: %f, max_est_dist: %f}" % (str(self._pos), dist, max_est_dist))
-                return -1
-
-            # scale (dist==0)->1.0, (dist==inf)->0.0
-            score = 1.0 / (dist+1)
+            too_far = dist > max_est_dist
 
             # Likewise, the new velocity should not be outside of what seems
             # possible w.r.t. acceleration.
-            new_vel = pt - self._pos
-            accel = numpy.linalg.norm(new_vel - self._vel)
+            new_vel = pts - pos
+            accel = numpy.hypot(*(new_vel - vel).T)
             max_accel_per_frame = 50
             max_accel = (self._missing_count + 1) * max_accel_per_frame
-            if accel > max_accel:
-                # not considered a valid point
-                logging.info("Point rejected due to acceleration: {pos: %s, vel: %s, new_vel: %s, accel: %f}" % (str(self._pos), str(self._vel), str(new_vel), accel))
-                return -1
+            too_fast = ~too_far & (accel > max_accel)
 
-            # consider the acceleration in the score as well
-            score *= 1.0 / (accel+1)
+            if too_far.any():
+                i = numpy.argmax(too_far)
+                self._log_rejection('distance', numpy.count_nonzero(too_far), "{pos: %s, dist: %f, max_est_dist: %f}" % (str(self._pos), dist[i], max_est_dist))
+            if too_fast.any():
+                i = numpy.argmax(too_fast)
+                self._log_rejection('acceleration', numpy.count_nonzero(too_fast), "{pos: %s, vel: %s, new_vel: %s, accel: %f}" % (str(self._pos), str(self._vel), str(new_vel[i]), accel[i]))
 
-            return score
+            # scale (dist==0)->1.0, (dist==inf)->0.0
+            # and consider the acceleration in the score as well
+            scores = 1.0 / (dist+1) / (accel+1)
+            # points that fail either test are not considered valid
+            scores[too_far | too_fast] = -1
+            return scores
         else:
             # as good as any other, if we have no idea where the fish is to start
-            return 0
+            return numpy.zeros(len(pts))
+
+    @property
+    def position_predicted(self):
+        '''Return the predicted position for the next frame in integer pixel coordinates.'''
+        if self._have_pos():
+            return tuple(int(x) for x in self._pos + self._vel)
+        else:
+            return tuple(self._pos)
 
     def _update_estimates(self, prevpos):
         '''Update estimated velocity based on status and previous data.
@@ -390,6 +743,9 @@ class Stream(object):
         if params is None:
             params = {}
 
+        self.frame_time = None  # see get_frame()
+        self.dropped = 0  # frames never dropped when read directly
+
         if type(source) == int:
             # webcam
             assert(conf is not None)
@@ -494,6 +850,85 @@ class Stream(object):
 
     def get_frame(self):
         rval, frame = self._video.read()
+        # monotonic time at which the most recent frame was captured
+        self.frame_time = time.monotonic()
         if not rval:
             return rval, frame
         return rval, frame
+
+
+class ThreadedStream(object):
+    '''Captures frames from a Stream in a separate thread, so capture overlaps
+    with processing.  Captured frames wait in a bounded queue, and each keeps
+    the time at which it was captured (available as frame_time after
+    get_frame() returns it).
+
+    drop_policy controls what happens when the queue is full:
+        'oldest': discard the oldest waiting frame (for live cameras, so
+                  processing always works on recent frames)
+        'block':  wait for room in the queue (for video files, so no frame
+                  is skipped)
+    '''
+    def __init__(self, stream, queue_size=2, drop_policy='oldest'):
+        assert drop_policy in ('oldest', 'block')
+        self._stream = stream
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._drop_policy = drop_policy
+        self.dropped = 0  # frames discarded under the 'oldest' policy
+        self.frame_time = None
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._capture_thread)
+        self._thread.daemon = True
+
+    def __getattr__(self, name):
+        '''Pass through anything else (width, sourcetype, ...) to the Stream.'''
+        return getattr(self._stream, name)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        # make room for the capture thread to notice, if it's blocked
+        try:
+            self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._thread.join()
+
+    def _put(self, item):
+        if self._drop_policy == 'block':
+            while not self._stopped.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+        else:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def _capture_thread(self):
+        try:
+            while not self._stopped.is_set():
+                rval, frame = self._stream.get_frame()
+                self._put((rval, frame, self._stream.frame_time))
+                if not rval:
+                    break
+        except Exception:
+            # end the stream, rather than leave get_frame() waiting forever
+            logging.exception("Capture failed.")
+            self._put((False, None, None))
+
+    def get_frame(self):
+        rval, frame, self.frame_time = self._queue.get()
+        return rval, frame
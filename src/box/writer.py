@@ -0,0 +1,188 @@
+'''Writing the experiment's output (track rows and debug frames) to disk.
+
+Writer does so directly, in the tracking loop.  WriterProcess hands the
+same data to a separate process through a bounded queue, so formatting,
+image encoding, and disk I/O never stall tracking.
+
+Track rows go to a track writer from trackformat.py (CSV or binary), events
+(lines of text, formatted by the caller) to an events file, and debug
+frames are stored in a single bundle per experiment (see framebundle.py).
+'''
+import logging
+import multiprocessing
+import os
+import signal
+
+import cv2
+
+from framebundle import FrameBundleWriter
+
+
+def save_clip(filename, frames, fps):
+    '''Save a sequence of grayscale frames (an array of shape (n, h, w)) as
+    a Motion-JPEG .avi video.'''
+    # Save as world-writable so rsync can delete them.
+    oldmask = os.umask(0)
+    h, w = frames.shape[1:3]
+    video = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'MJPG'), fps, (w, h), False)
+    for frame in frames:
+        video.write(frame)
+    video.release()
+    os.umask(oldmask)
+
+
+class Writer(object):
+    '''Writes track rows (to trackfile, a trackformat.CSVTrackWriter or
+    BinaryTrackWriter), events (to the file named eventsfile, if given),
+    and debug frames immediately.'''
+    def __init__(self, trackfile, debugframe_dir, eventsfile=None):
+        self._trackfile = trackfile
+        self._debugframe_dir = debugframe_dir
+        self._eventsfile = eventsfile
+        self._bundle = None  # opened when first needed, by the writing process
+        self._events = None  # ditto
+        self._closed = False
+
+    def start(self):
+        pass
+
+    def write_row(self, frametime, *values):
+        '''Write a row of track data (see trackformat.format_row() for the
+        values).'''
+        self._trackfile.write_row(frametime, *values)
+
+    def mark(self, kind, value):
+        '''Record in the track's index that the next row starts the given
+        phase or minute (see trackformat.read_index()).'''
+        self._trackfile.mark(kind, value)
+
+    def _write_event(self, line):
+        if self._eventsfile is None:
+            return
+        if self._events is None:
+            self._events = open(self._eventsfile, 'w')
+        self._events.write(line)
+
+    def write_event(self, line):
+        '''Write a line (with its newline) to the events file.'''
+        self._write_event(line)
+
+    def _save_frame(self, frame_num, kind, status, image):
+        if self._bundle is None:
+            self._bundle = FrameBundleWriter(self._debugframe_dir)
+        self._bundle.add(frame_num, kind, status, image)
+
+    def save_frame(self, frame_num, kind, status, image):
+        '''Save a debug frame: kind is 'frame' (the full frame) or 'subframe'
+        (the tank region).  Returns True if the image will be saved, False if
+        it was dropped.'''
+        self._save_frame(frame_num, kind, status, image)
+        return True
+
+    def save_clip(self, filename, frames, fps):
+        '''Save frames (an array of shape (n, h, w)) as a video clip.  The
+        array must not be modified afterward.  Returns True if the clip will
+        be saved, False if it was dropped.'''
+        save_clip(filename, frames, fps)
+        return True
+
+    def _close(self):
+        self._trackfile.flush()
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+        if self._bundle is not None:
+            self._bundle.close()
+            self._bundle = None
+
+    def close(self):
+        if self._closed:
+            return  # (closed at the end of the experiment and again at exit)
+        self._closed = True
+        self._close()
+
+
+class WriterProcess(Writer):
+    '''Writes track rows and debug frames in a separate process.
+
+    Data waits in a queue of at most queue_size items.  Track rows are
+    never dropped: if the queue is full, write_row() waits for room.  Debug
+    frames and clips may only fill half the queue, though; beyond that,
+    they are dropped, so track rows always have room in the queue.
+
+    The track file is inherited by the writer process (on fork), and the
+    tracking process must not write to it after start().
+    '''
+    def __init__(self, trackfile, debugframe_dir, eventsfile=None, queue_size=100):
+        super(WriterProcess, self).__init__(trackfile, debugframe_dir, eventsfile)
+        self._queue = multiprocessing.Queue(queue_size)
+        # slots in the queue that debug frames may use
+        self._frame_slots = multiprocessing.BoundedSemaphore(max(1, queue_size // 2))
+        self.dropped_frames = 0
+        self._p = None
+
+    def start(self):
+        # don't let the writer process inherit (and duplicate) buffered data
+        self._trackfile.flush()
+        self._p = multiprocessing.Process(target=self._writer_process)
+        self._p.start()
+
+    def _writer_process(self):
+        # ignore signals that will be handled by parent
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, data = item
+            if kind == 'row':
+                self._trackfile.write_row(*data)
+            elif kind == 'mark':
+                self._trackfile.mark(*data)
+            elif kind == 'event':
+                self._write_event(data)
+            elif kind == 'frame':
+                self._save_frame(*data)
+                self._frame_slots.release()
+            elif kind == 'clip':
+                save_clip(*data)
+                self._frame_slots.release()
+
+        # the process exits without flushing open files
+        self._close()
+
+    def write_row(self, frametime, *values):
+        self._queue.put(('row', (frametime,) + values))
+
+    def mark(self, kind, value):
+        self._queue.put(('mark', (kind, value)))
+
+    def write_event(self, line):
+        self._queue.put(('event', line))
+
+    def save_frame(self, frame_num, kind, status, image):
+        if not self._frame_slots.acquire(False):
+            self.dropped_frames += 1
+            return False
+        # copy, as the image may be reused for later frames
+        self._queue.put(('frame', (frame_num, kind, status, image.copy())))
+        return True
+
+    def save_clip(self, filename, frames, fps):
+        if not self._frame_slots.acquire(False):
+            self.dropped_frames += len(frames)
+            return False
+        self._queue.put(('clip', (filename, frames, fps)))
+        return True
+
+    def close(self):
+        '''Write everything still queued, then stop the writer process.'''
+        p, self._p = self._p, None  # in case of a concurrent call
+        if p is None:
+            return
+        self._queue.put(None)
+        p.join()
+        if self.dropped_frames:
+            logging.warn("Writer: %d debug frames dropped (writer could not keep up).", self.dropped_frames)
@@ -6,6 +6,7 @@ BASEDIR = Path(__file__).resolve().parent.parent
 DATADIR = BASEDIR / "data"
 DBFILE      = DATADIR / "atles.db"
 LOCKFILE    = DATADIR / "current_experiment.lock"
+TIMINGFILE  = DATADIR / "current_experiment_timing.json"
 TRACKDIR    = DATADIR / "tracks"
 PLOTDIR     = DATADIR / "plots"
 ARCHIVEDIR  = DATADIR / "tracks_archive"
@@ -0,0 +1,102 @@
+'''Debug frames stored in a single bundle per experiment.
+
+A bundle is a pair of files in an experiment's debug frame directory:
+frames.bundle, JPEG images appended one after another, and frames.index,
+a CSV file with one line per image (frame number, kind of image -- 'frame'
+or 'subframe' -- tracking status, and the image's offset and length in the
+bundle).  Both are only ever appended to, and each image is written before
+its index line, so an experiment that stops unexpectedly still leaves a
+readable bundle.  Any image can be read by frame number without reading the
+rest of the bundle.
+'''
+import collections
+import csv
+import os
+from pathlib import Path
+
+import cv2
+import numpy
+
+BUNDLE_NAME = "frames.bundle"
+INDEX_NAME = "frames.index"
+
+Entry = collections.namedtuple('Entry', ['frame_num', 'kind', 'status', 'offset', 'length'])
+
+# Bundles opened by open_bundle(): dirpath -> (index mtime and size, FrameBundle)
+_CACHE_SIZE = 8
+_cache = collections.OrderedDict()
+
+
+class FrameBundleWriter(object):
+    def __init__(self, dirpath, quality=90):
+        dirpath = Path(dirpath)
+        # Create as world-writable so rsync can delete them.
+        oldmask = os.umask(0)
+        self._bundle = open(str(dirpath / BUNDLE_NAME), 'ab')
+        self._index = open(str(dirpath / INDEX_NAME), 'a')
+        os.umask(oldmask)
+        self._params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+    def add(self, frame_num, kind, status, image):
+        rval, jpeg = cv2.imencode('.jpg', image, self._params)
+        offset = self._bundle.tell()
+        self._bundle.write(jpeg.tobytes())
+        self._bundle.flush()
+        self._index.write("%d,%s,%s,%d,%d\n" % (frame_num, kind, status, offset, len(jpeg)))
+        self._index.flush()
+
+    def close(self):
+        self._bundle.close()
+        self._index.close()
+
+
+class FrameBundle(object):
+    '''Reads the bundle in a debug frame directory.'''
+    def __init__(self, dirpath):
+        dirpath = Path(dirpath)
+        self._path = dirpath / BUNDLE_NAME
+        self.entries = []
+        self._lookup = {}  # (frame_num, kind) -> Entry
+        with (dirpath / INDEX_NAME).open() as f:
+            for row in csv.reader(f):
+                if len(row) != 5:
+                    continue  # incomplete last line
+                entry = Entry(int(row[0]), row[1], row[2], int(row[3]), int(row[4]))
+                self.entries.append(entry)
+                self._lookup[entry.frame_num, entry.kind] = entry
+
+    @staticmethod
+    def exists(dirpath):
+        return (Path(dirpath) / INDEX_NAME).is_file()
+
+    def get_jpeg(self, frame_num, kind='subframe'):
+        '''Return the JPEG data of the given frame.  Raises KeyError if it
+        isn't in the bundle.'''
+        entry = self._lookup[frame_num, kind]
+        with self._path.open('rb') as f:
+            f.seek(entry.offset)
+            return f.read(entry.length)
+
+    def get_image(self, frame_num, kind='subframe'):
+        '''Return the given frame, decoded.'''
+        jpeg = numpy.frombuffer(self.get_jpeg(frame_num, kind), dtype=numpy.uint8)
+        return cv2.imdecode(jpeg, cv2.IMREAD_UNCHANGED)
+
+
+def open_bundle(dirpath):
+    '''Return a FrameBundle for dirpath, reusing the one opened there last
+    unless its index has changed since (as it does while the experiment is
+    running), so reading many frames from one bundle parses its index just
+    once.'''
+    dirpath = Path(dirpath)
+    stat = (dirpath / INDEX_NAME).stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.pop(dirpath, None)
+    if cached is not None and cached[0] == version:
+        bundle = cached[1]
+    else:
+        bundle = FrameBundle(dirpath)
+    _cache[dirpath] = (version, bundle)
+    while len(_cache) > _CACHE_SIZE:
+        _cache.popitem(last=False)
+    return bundle
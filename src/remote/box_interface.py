@@ -1,4 +1,5 @@
 import errno
+import json
 import os
 import signal
 import subprocess
@@ -28,6 +29,17 @@ def lock_data():
                 }
 
 
+def timing_data():
+    '''Per-stage timing of the running (or most recent) experiment's
+    tracking loop: {'time': <when written>, 'stages': {stage: {count, mean,
+    p50, p95, p99, max}}}, with times in ms, or None if not available.'''
+    try:
+        with config.TIMINGFILE.open('r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
 def max_datafile_mtime():
     return max_mtime(config.TRACKDIR)
 
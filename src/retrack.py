@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#
+# retrack.py - Re-track recorded videos with a given configuration, running
+#              the tracking headless (no lockfile, sensors, display, or
+#              stimulus) in a pool of worker processes, one video per worker.
+#              Writes the usual -track.csv, -setup.txt, and .log files.
+#
+#              With --segment-minutes, long videos are split into segments
+#              tracked in parallel as well, and the segments' tracks are
+#              stitched back together (see box/offline.py).  Splitting works
+#              best on files that can be seeked (e.g., .mp4); in a raw .h264
+#              stream, each segment has to decode every frame before it.
+#
+# e.g.:  ./retrack.py --inifile ../ini/ac_shock_left50.ini --outdir ../data/retracked ../data/videos/*.h264
+#
+
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import atles_box
+import trackformat
+from common import mkdir
+from box import offline
+
+
+def _log_handler(outdir, name):
+    '''A handler for logging to the .log file for the named video.'''
+    fh = logging.FileHandler(filename=str(outdir / ("%s.log" % name)))
+    fh.setFormatter(
+        logging.Formatter(fmt="%(asctime)s [%(levelname)s] %(message)s"))
+    return fh
+
+
+def write_setup(vidfile, conf, setup_phases, outdir):
+    '''Record the setup, with any phases given (tracking itself runs as one
+    phase, as phase lengths are in real time, not video time).'''
+    setup_conf = dict(conf)
+    setup_conf['general'] = dict(conf['general'], vidfile=os.path.abspath(vidfile))
+    setup_conf['phases'] = setup_phases
+    setup_conf['name'] = Path(vidfile).stem
+    atles_box.write_setup(setup_conf, trackdir=outdir)
+
+
+def retrack_one(task):
+    '''Track one video or one segment of a video.  Run in a worker process.
+
+    A whole video's track is written to its -track.csv file in outdir; a
+    segment's track is returned (as a list of rows) for stitching.
+    '''
+    vidfile, conf, outdir, debug_frames, segment, segnum = task
+    name = Path(vidfile).stem
+
+    # log to a file for this video only
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(_log_handler(outdir, name))
+
+    if segment is None:
+        logging.info("Re-tracking %s", vidfile)
+    else:
+        logging.info("Re-tracking %s, segment %d (frames %d-%d, recording from %d)",
+                     vidfile, segnum, segment.first, segment.last - 1, segment.output)
+
+    rows = None
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if debug_frames:
+                debugframe_dir = outdir / "debug_frames" / name
+                mkdir(debugframe_dir)
+            else:
+                # Experiment still saves the first frame; discard it
+                debugframe_dir = tmpdir
+            if segment is None:
+                trackfile = open(str(outdir / (name + trackformat.CSV_SUFFIX)), 'w')
+                indexfile = open(str(outdir / (name + trackformat.INDEX_SUFFIX)), 'w')
+            else:
+                # (indexed when the segments are stitched together)
+                trackfile = io.StringIO()
+                indexfile = io.StringIO()
+            with trackfile, indexfile:
+                run_conf = offline.offline_conf(conf, trackfile, str(debugframe_dir), indexfile)
+                exp, elapsed = offline.run(run_conf, vidfile, debug_frames, segment=segment)
+                if segment is not None:
+                    rows = trackfile.getvalue().splitlines(True)
+    except Exception as e:
+        logging.exception("Re-tracking %s failed.", vidfile)
+        return vidfile, segnum, None, str(e), None
+
+    frames = exp.stage_timing()['subframe']['count']
+    logging.info("Tracked %d frames in %0.1fs.", frames, elapsed)
+    return vidfile, segnum, frames, elapsed, rows
+
+
+def split_video(vidfile, conf, args):
+    '''Return the segments in which to track vidfile and its frame rate.'''
+    framecount, fps = offline.count_frames(vidfile)
+    segments = offline.plan_segments(
+        framecount,
+        length=int(args.segment_minutes * 60 * fps),
+        warmup=int(args.warmup * fps),
+        overlap=int(args.overlap * fps),
+        start_frame=conf['tracking']['start_frame'],
+    )
+    return segments, fps
+
+
+def stitch_video(vidfile, segments, tracks, fps, outdir):
+    '''Stitch the tracks of a video's segments into its -track.csv file
+    (and its index).'''
+    name = Path(vidfile).stem
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(_log_handler(outdir, name))
+
+    rows, switches = offline.stitch(segments, tracks, fps)
+    for segnum, switch in enumerate(switches, start=1):
+        if switch is None:
+            logger.warning("Segments %d and %d never agreed on the fish's position; switched at frame %d.",
+                           segnum - 1, segnum, segments[segnum-1].last)
+        else:
+            logger.info("Switched from segment %d to %d at frame %d.", segnum - 1, segnum, switch)
+    trackfile = trackformat.open_writer(str(outdir / name))
+    # tracked as a single phase, as in an unsplit run
+    trackfile.mark('phase', 1)
+    for row in rows:
+        trackfile.write_formatted(row)
+    trackfile.close()
+    logger.info("Stitched %d segments into %d track rows.", len(segments), len(rows))
+    return switches
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Re-track recorded videos in parallel.')
+    parser.add_argument('vidfiles', type=str, nargs='+',
+                        help='video files to track')
+    parser.add_argument('--inifile', type=str, required=True,
+                        help='configuration file specifying the physical setup and tracking configuration')
+    parser.add_argument('--outdir', type=str, required=True,
+                        help='directory for the -track.csv, -setup.txt, and .log output files (named after each video)')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of videos to track at once (default: number of CPUs, %d)' % multiprocessing.cpu_count())
+    parser.add_argument('--debug-frames', type=int, default=0, metavar='N',
+                        help='save an image of the current frame every N frames, as atles_box.py does (default: 0 = none)')
+
+    parser.add_argument('--notes', type=str,
+                        help='additional notes to be saved in each -setup.txt file (optional)')
+    parser.add_argument('-p', '--phases', type=str, action='append',
+                        help='phases to record in each -setup.txt file for analysis, in the format used by atles_box.py (optional)')
+
+    seg_group = parser.add_argument_group('splitting long videos')
+    seg_group.add_argument('--segment-minutes', type=float, default=0, metavar='M',
+                           help='split each video into segments of M minutes of video, tracked in parallel and stitched together (default: 0 = no splitting)')
+    seg_group.add_argument('--warmup', type=float, default=60, metavar='S',
+                           help='seconds of video before each segment used only to warm up the background model (default: 60)')
+    seg_group.add_argument('--overlap', type=float, default=10, metavar='S',
+                           help='seconds of video tracked by both neighboring segments, in which to reconcile their tracks (default: 10)')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    conf = atles_box.get_conf(args)
+    # the pool's worker processes can't start the pipeline's or writer's
+    # processes (and the pool already uses every core)
+    conf['tracking']['pipeline_slots'] = 0
+    conf['tracking']['writer_queue_size'] = 0
+
+    setup = {}
+    if args.phases:
+        atles_box.setup_phases(args, setup)
+    setup_phases = setup.get('phases', {})
+
+    outdir = Path(args.outdir)
+    mkdir(outdir)
+
+    if args.segment_minutes and args.debug_frames:
+        print("--debug-frames can't be used with --segment-minutes.")
+        sys.exit(1)
+
+    tasks = []
+    splits = {}  # vidfile -> segments, fps, and their tracks (by segment number)
+    for vidfile in args.vidfiles:
+        write_setup(vidfile, conf, setup_phases, outdir)
+        if args.segment_minutes:
+            segments, fps = split_video(vidfile, conf, args)
+            splits[vidfile] = (segments, fps, {})
+            for segnum, segment in enumerate(segments):
+                tasks.append((vidfile, conf, outdir, args.debug_frames, segment, segnum))
+        else:
+            tasks.append((vidfile, conf, outdir, args.debug_frames, None, None))
+
+    start = time.time()
+    failed = set()
+    # one video or segment per worker process, so no state carries over
+    pool = multiprocessing.Pool(args.jobs, maxtasksperchild=1)
+    for i, (vidfile, segnum, frames, result, rows) in enumerate(pool.imap_unordered(retrack_one, tasks)):
+        desc = vidfile if segnum is None else "%s [segment %d]" % (vidfile, segnum)
+        if frames is None:
+            print("[%d/%d] %s: FAILED: %s" % (i+1, len(tasks), desc, result))
+            failed.add(vidfile)
+            continue
+        print("[%d/%d] %s: %d frames in %0.1fs (%0.1f fps)" % (i+1, len(tasks), desc, frames, result, frames / result))
+
+        if segnum is not None and vidfile not in failed:
+            segments, fps, tracks = splits[vidfile]
+            tracks[segnum] = rows
+            if len(tracks) == len(segments):
+                switches = stitch_video(vidfile, segments, [tracks[n] for n in range(len(segments))], fps, outdir)
+                print("%s: stitched %d segments (%d without agreement)" % (vidfile, len(segments), switches.count(None)))
+                del splits[vidfile]
+    pool.close()
+    pool.join()
+
+    print("Re-tracked %d videos in %0.1fs." % (len(args.vidfiles) - len(failed), time.time() - start))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
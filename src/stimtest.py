@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# stimtest.py - Check the timing of a duty-cycled GPIO stimulus, with the
+#               wiring mocked: runs the stimulus loop for thousands of cycles,
+#               recording the time of every pin change, and checks the
+#               frequency and duty cycle achieved against those requested.
+#               Exits with an error if either is off by more than the given
+#               tolerance, or if any cycle was skipped.
+#
+# e.g.:  ./stimtest.py --freq 100 --duty 0.25 --cycles 2000
+#
+
+import argparse
+import sys
+import threading
+import time
+
+import numpy
+
+from box import stimulus
+from box import wiring
+
+
+def run_stimulus(freq, duty, cycles):
+    '''Run a GPIOStimulus for the given number of cycles, returning its
+    DutyCycle and a list of (time, value) for every change of its pin.'''
+    changes = []
+
+    def record(pin, val):
+        changes.append((time.monotonic(), val))
+
+    # never touch the real pins
+    wiring.wiring_mocked = True
+    wiring.out = record
+
+    stim = stimulus.GPIOStimulus(pin=0, freq_Hz=freq, duty_cycle=duty)
+
+    def drive():
+        stim.show(1, time.monotonic())
+        time.sleep((cycles + 0.5) / freq)
+        stim.show(0, time.monotonic())
+        stim._pipe.send('end')
+
+    # The stimulus loop runs in this (main) thread, as it would in the
+    # stimulus process, while another thread sends it commands.
+    driver = threading.Thread(target=drive)
+    driver.start()
+    stim._stimulus_thread(stim._child_pipe)
+    driver.join()
+
+    return stim._duty_cycle, changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the timing of a duty-cycled stimulus (with mocked wiring).')
+    parser.add_argument('-f', '--freq', type=float, default=100,
+                        help='stimulus frequency in Hz (default: 100)')
+    parser.add_argument('-d', '--duty', type=float, default=0.25,
+                        help='duty cycle, 0.0-1.0 (default: 0.25)')
+    parser.add_argument('-c', '--cycles', type=int, default=2000,
+                        help='number of cycles to run (default: 2000)')
+    parser.add_argument('--freq-tolerance', type=float, default=0.1,
+                        help='maximum error in the achieved frequency, in percent (default: 0.1)')
+    parser.add_argument('--duty-tolerance', type=float, default=0.01,
+                        help='maximum error in the achieved duty cycle, as a fraction (default: 0.01)')
+    args = parser.parse_args()
+
+    print("Running %d cycles at %g Hz, duty cycle %g..." % (args.cycles, args.freq, args.duty))
+    duty_cycle, changes = run_stimulus(args.freq, args.duty, args.cycles)
+
+    ons = numpy.array([t for t, val in changes if val == 1])
+    offs = numpy.array([t for t, val in changes if val == 0 and t > ons[0]])
+    n = min(len(ons), len(offs)) - 1  # complete cycles
+    ons, offs = ons[:n+1], offs[:n]
+    # cycles actually delivered per second (so any skipped lower it)
+    freq = n / (ons[-1] - ons[0])
+    duty = numpy.mean(offs - ons[:n]) * freq
+
+    freq_error = 100 * abs(freq / args.freq - 1)
+    duty_error = abs(duty - args.duty)
+    print("Cycles:     %d (%d skipped)" % (n, duty_cycle.skipped))
+    print("Frequency:  %0.4f Hz (error %0.4f%%)" % (freq, freq_error))
+    print("Duty cycle: %0.4f (error %0.4f)" % (duty, duty_error))
+    stats = duty_cycle.jitter.summary()
+    print("Lateness of toggles (ms): mean %0.3f, p50 %0.3f, p95 %0.3f, p99 %0.3f, max %0.3f" % (
+        stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max']))
+
+    ok = True
+    if n < args.cycles - 1:
+        print("FAIL: only %d of %d cycles completed." % (n, args.cycles))
+        ok = False
+    if duty_cycle.skipped:
+        print("FAIL: %d cycles skipped." % duty_cycle.skipped)
+        ok = False
+    if freq_error > args.freq_tolerance:
+        print("FAIL: frequency off by more than %g%%." % args.freq_tolerance)
+        ok = False
+    if duty_error > args.duty_tolerance:
+        print("FAIL: duty cycle off by more than %g." % args.duty_tolerance)
+        ok = False
+    if not ok:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+'''Track files: one row of data per tracked frame of an experiment.
+
+A track file is written in one of two formats:
+
+  CSV (-track.csv): one line of text per row, "time,status,x,y,numpts,sensor_seq",
+  with '.' for x and y when the fish's position is not known.
+
+  Binary (-track.bin): a header (MAGIC, format version, header length, and
+  record length) followed by fixed-width records (RECORD_DTYPE).  The
+  status is stored as an index into STATUSES, and unknown positions are
+  NaN.  Positions are rounded to the precision of the CSV format before
+  they are stored, so both formats hold the same data.  A binary track can
+  be read directly with numpy.memmap (see read_records()), with no parsing
+  at all.
+
+sensor_seq is the sequence number of the latest sensor reading when the
+frame was tracked (0 if there were no sensors).  The readings themselves
+are in a separate file (-sensors.csv, "seq,time,temp,lux"; see
+box/sensors.py and read_sensors()).  Tracks written before that carried the
+temperature and light level in every row instead ("...,numpts,temp,lux",
+and version 1 of the binary format); those can still be read.
+
+Alongside either format, the box writes an index (-track.index) of the row
+at which each minute and each phase of the track starts, so a time range or
+a phase can be read without reading the whole track (see read_index()).
+
+read_dataframe() reads either format into the same pandas DataFrame, and
+to_csv() (or running this module: "python trackformat.py FILE.bin ...")
+converts a binary track into the equivalent CSV.
+'''
+import bisect
+import io
+import math
+import os
+import struct
+import sys
+import time
+
+import numpy
+
+CSV_SUFFIX = "-track.csv"
+BIN_SUFFIX = "-track.bin"
+SUFFIXES = (CSV_SUFFIX, BIN_SUFFIX)
+INDEX_SUFFIX = "-track.index"
+SENSORS_SUFFIX = "-sensors.csv"
+
+MAGIC = b'ATLTRACK'
+VERSION = 2
+HEADER = struct.Struct('<8sHHI')  # magic, version, header length, record length
+
+STATUSES = ['init', 'acquired', 'missing', 'lost']
+_STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# little-endian and unpadded, so records match RECORD exactly
+RECORD_DTYPE = numpy.dtype([
+    ('time', '<f8'),
+    ('status', 'u1'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('numpts', '<u2'),
+    ('sensor_seq', '<u4'),
+])
+RECORD = struct.Struct('<dBffHI')
+
+# version 1 records, with sensor readings in every row
+RECORD_DTYPE_V1 = numpy.dtype([
+    ('time', '<f8'),
+    ('status', 'u1'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('numpts', '<u2'),
+    ('temp', '<f4'),
+    ('lux', '<i4'),
+])
+_RECORD_DTYPES = {1: RECORD_DTYPE_V1, VERSION: RECORD_DTYPE}
+
+# columns of a CSV track (in older tracks, _1 and _2 are the temperature and
+# light level; in current tracks, _1 is sensor_seq and _2 is empty)
+COLNAMES = ['time', 'status', 'x', 'y', 'numpts', '_1', '_2']
+
+
+def _format_pos(pos):
+    if pos[0] is None:
+        return ".,."
+    return "%0.3f,%0.3f" % (pos[0], pos[1])
+
+
+def format_row(frametime, status, pos, numpts, sensor_seq):
+    '''Format one row of a CSV track file.'''
+    return "%0.4f,%s,%s,%d,%d\n" % (frametime, status, _format_pos(pos), numpts, sensor_seq)
+
+
+def _format_row_v1(frametime, status, pos, numpts, temp, lux):
+    return "%0.4f,%s,%s,%d,%0.2f,%d\n" % (frametime, status, _format_pos(pos), numpts, temp, lux)
+
+
+def strip_suffix(name):
+    '''Return a track file's name or path (a string) without its -track.csv
+    or -track.bin suffix.'''
+    for suffix in SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def is_binary(path):
+    return str(path).endswith(BIN_SUFFIX)
+
+
+class _TrackWriter(object):
+    '''Common parts of the track writers: counting rows and bytes written,
+    and writing the index (if given an index file object; see read_index()).
+    Subclasses write the rows themselves, in _write().'''
+    def __init__(self, f, index=None):
+        self._f = f
+        self._index = index
+        self._rows = 0
+        self._offset = 0  # of the next row in the file
+        self._next_minute = 0
+
+    def mark(self, kind, value):
+        '''Record in the index that the next row written starts the given
+        minute or phase (kind = 'minute' or 'phase').'''
+        if self._index is not None:
+            self._index.write("%s,%d,%d,%d\n" % (kind, value, self._rows, self._offset))
+            self._index.flush()
+
+    def _mark_minutes(self, frametime):
+        while frametime >= self._next_minute * 60:
+            self.mark('minute', self._next_minute)
+            self._next_minute += 1
+
+    def write_row(self, frametime, status, pos, numpts, sensor_seq):
+        self._mark_minutes(frametime)
+        self._offset += self._write(frametime, status, pos, numpts, sensor_seq)
+        self._rows += 1
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self.flush()
+        self._f.close()
+        if self._index is not None:
+            self._index.close()
+
+
+class CSVTrackWriter(_TrackWriter):
+    '''Writes track rows to a text file object as CSV.'''
+    suffix = CSV_SUFFIX
+
+    def _write(self, *values):
+        row = format_row(*values)
+        self._f.write(row)
+        return len(row)  # all ASCII, so characters = bytes
+
+    def write_formatted(self, row):
+        '''Write a row already formatted by format_row() (e.g., read from
+        another track file).'''
+        self._mark_minutes(float(row.split(',', 1)[0]))
+        self._f.write(row)
+        self._offset += len(row)
+        self._rows += 1
+
+
+class BinaryTrackWriter(_TrackWriter):
+    '''Writes track rows to a binary file object as fixed-width records.
+
+    The data is synced to disk (fsync) at least every sync_interval seconds
+    of writing, and whenever flush() is called, so at most a few seconds of
+    the track are lost if the box loses power.
+    '''
+    suffix = BIN_SUFFIX
+
+    def __init__(self, f, index=None, sync_interval=5.0):
+        super(BinaryTrackWriter, self).__init__(f, index)
+        self._sync_interval = sync_interval
+        self._f.write(HEADER.pack(MAGIC, VERSION, HEADER.size, RECORD.size))
+        self._offset = HEADER.size
+        self._last_sync = time.monotonic()
+
+    def _write(self, frametime, status, pos, numpts, sensor_seq):
+        if pos[0] is None:
+            x = y = float('nan')
+        else:
+            x, y = round(pos[0], 3), round(pos[1], 3)
+        self._f.write(RECORD.pack(frametime, _STATUS_CODES[status], x, y, min(numpts, 0xffff), sensor_seq))
+        if time.monotonic() - self._last_sync >= self._sync_interval:
+            self.flush()
+        return RECORD.size
+
+    def flush(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._last_sync = time.monotonic()
+
+
+def open_writer(basename, track_format='csv'):
+    '''Create a track file for writing, with its index: basename +
+    -track.csv or -track.bin, for track_format 'csv' or 'binary', and
+    basename + -track.index.  Returns a CSVTrackWriter or BinaryTrackWriter.'''
+    if track_format == 'csv':
+        writer_class, suffix, mode = CSVTrackWriter, CSV_SUFFIX, 'w'
+    elif track_format == 'binary':
+        writer_class, suffix, mode = BinaryTrackWriter, BIN_SUFFIX, 'wb'
+    else:
+        raise ValueError("Unknown track format: %s" % track_format)
+    return writer_class(open(basename + suffix, mode), index=open(basename + INDEX_SUFFIX, 'w'))
+
+
+def read_records(path):
+    '''Return the records of a binary track file as a (read-only) numpy
+    array of RECORD_DTYPE (or RECORD_DTYPE_V1, for a version 1 file),
+    mapped from the file rather than read into memory.  An incomplete last
+    record (from a track still being written) is ignored.'''
+    with open(str(path), 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Not a binary track file (too short): %s" % path)
+    magic, version, header_len, record_len = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a binary track file: %s" % path)
+    dtype = _RECORD_DTYPES.get(version)
+    if dtype is None or record_len != dtype.itemsize:
+        raise ValueError("Unsupported binary track file version %d: %s" % (version, path))
+
+    count = (os.path.getsize(str(path)) - header_len) // record_len
+    if count <= 0:
+        return numpy.zeros(0, dtype=dtype)  # can't map an empty region
+    return numpy.memmap(str(path), dtype=dtype, mode='r', offset=header_len, shape=(count,))
+
+
+def index_path(path):
+    '''Return the path of the index for a track file (a string).'''
+    return strip_suffix(str(path)) + INDEX_SUFFIX
+
+
+def read_index(path):
+    '''Read the index of track file path, if it has one (else return None).
+
+    The index has a line for every minute of the track and for the start of
+    every phase: "minute,<minute>,<row>,<offset>" or "phase,<phase
+    number>,<row>,<offset>", giving the number of the first row of that
+    minute or phase in the track file and that row's byte offset in the
+    file.  Returns a dict mapping 'minute' and 'phase' to lists of (minute
+    or phase number, row, offset) tuples.
+    '''
+    index = {'minute': [], 'phase': []}
+    try:
+        f = open(index_path(path))
+    except FileNotFoundError:
+        return None
+    with f:
+        for line in f:
+            if not line.endswith('\n'):
+                break  # incomplete last line
+            kind, value, row, offset = line.split(',')
+            index.setdefault(kind, []).append((int(value), int(row), int(offset)))
+    return index
+
+
+def _index_span(index, start, end, phase):
+    '''Return the (row, offset) of the first row and of the row after the last
+    row (or (None, None) for the end of the file) that may hold the
+    requested time range or phase, according to the index.'''
+    if phase is not None:
+        entries = index['phase']
+        phases = [entry[0] for entry in entries]
+        if phase not in phases:
+            raise ValueError("Phase %d not found in track index." % phase)
+        i = phases.index(phase)
+        first = entries[i][1:]
+        last = entries[i+1][1:] if i+1 < len(entries) else (None, None)
+        return first, last
+
+    entries = index['minute']
+    minutes = [entry[0] for entry in entries]
+    # rows before the entry for the minute containing start are all earlier
+    i = bisect.bisect_right(minutes, start / 60.0) - 1 if start is not None else 0
+    first = entries[i][1:] if i >= 0 and entries else (0, None)
+    # rows after the entry for the first minute starting at or after end are all later
+    j = bisect.bisect_left(minutes, end / 60.0) if end is not None else len(entries)
+    last = entries[j][1:] if j < len(entries) else (None, None)
+    return first, last
+
+
+def _records_dataframe(records):
+    import pandas  # only needed for analysis, not on the boxes
+    columns = ['status', 'x', 'y', 'numpts'] + list(records.dtype.names[5:])
+    data = {
+        'status': numpy.array(STATUSES, dtype=object)[records['status']],
+        'x': records['x'].astype(numpy.float64),
+        'y': records['y'].astype(numpy.float64),
+        'numpts': records['numpts'].astype(numpy.int64),
+    }
+    for name in columns[4:]:
+        data[name] = records[name].astype(numpy.float64 if name == 'temp' else numpy.int64)
+    return pandas.DataFrame(data, index=pandas.Index(numpy.array(records['time']), name='time'), columns=columns)
+
+
+def _csv_columns(source):
+    '''Return the number of columns in the first complete row of a CSV track
+    (a path or a binary file object, left at its start), or in its first
+    row if none is complete.'''
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return _csv_columns(f)
+    first = line = source.readline()
+    while line and not line.endswith(b'\n'):
+        line = source.readline()
+    source.seek(0)
+    return (line or first).count(b',') + 1
+
+
+def _csv_dataframe(source):
+    import pandas
+    # an older track, with sensor readings in every row, has one more
+    # column (decided by a complete row, as the last may be truncated)
+    older = _csv_columns(source) == len(COLNAMES)
+    df = pandas.read_csv(
+        source, header=None, names=COLNAMES, index_col=0,
+        # (empty fields only in the last row, if truncated, and in _2)
+        na_values={'x': ['.', ''], 'y': ['.', ''], 'numpts': [''], '_1': [''], '_2': ['']}, keep_default_na=False,
+    )
+    if older:
+        return df.rename(columns={'_1': 'temp', '_2': 'lux'})
+    df = df.drop(columns='_2').rename(columns={'_1': 'sensor_seq'})
+    if df['sensor_seq'].notnull().all():  # (not if the last row is truncated)
+        df['sensor_seq'] = df['sensor_seq'].astype(numpy.int64)
+    return df
+
+
+def read_dataframe(path, start=None, end=None, phase=None, return_first_row=False):
+    '''Read a track file (either format) into a DataFrame indexed by time,
+    with columns status, x, y, numpts, and sensor_seq (or, for older
+    tracks, temp and lux).  Unknown positions are given as -1.
+
+    With start and/or end (in seconds), only the rows from start up to (not
+    including) end are returned.  With phase (a phase number), only the
+    rows of that phase are, which requires the track's index.  Where the
+    index allows, only the rows needed are read from the file.
+
+    With return_first_row, returns (DataFrame, row), where row is the
+    number in the whole track (from 0) of the DataFrame's first row.
+    '''
+    index = None
+    first_row = 0
+    if start is not None or end is not None or phase is not None:
+        index = read_index(path)
+        if phase is not None and index is None:
+            raise ValueError("No index for track %s; can't find phase %d." % (path, phase))
+
+    if is_binary(path):
+        records = read_records(path)
+        if index is not None and phase is not None:
+            (first_row, _), (last, _) = _index_span(index, start, end, phase)
+            records = records[first_row:last]
+        elif start is not None or end is not None:
+            # times are in order, so a binary search only touches a few pages
+            first_row = int(numpy.searchsorted(records['time'], start)) if start is not None else 0
+            last = numpy.searchsorted(records['time'], end) if end is not None else len(records)
+            records = records[first_row:last]
+        df = _records_dataframe(records)
+    elif index is not None:
+        (first_row, first), (_, last) = _index_span(index, start, end, phase)
+        with open(str(path), 'rb') as f:
+            f.seek(first or 0)
+            data = f.read(last - (first or 0) if last is not None else -1)
+        df = _csv_dataframe(io.BytesIO(data)) if data else _records_dataframe(numpy.zeros(0, dtype=RECORD_DTYPE))
+    else:
+        df = _csv_dataframe(str(path))
+
+    if start is not None:
+        # times are in order, so any rows dropped here are at the start
+        first_row += int((df.index < start).sum())
+        df = df[df.index >= start]
+    if end is not None:
+        df = df[df.index < end]
+    df[['x', 'y']] = df[['x', 'y']].fillna(-1)
+    if return_first_row:
+        return df, first_row
+    return df
+
+
+def read_phase(path, phase, start, end, return_first_row=False):
+    '''Read the rows of phase number phase of a track file: those the box
+    recorded in that phase, if the track's index has it, or else those from
+    start to end (in seconds; the phase's scheduled times, for tracks
+    without an index).  return_first_row is as for read_dataframe().'''
+    index = read_index(path)
+    if index is not None and phase in (entry[0] for entry in index['phase']):
+        return read_dataframe(path, phase=phase, return_first_row=return_first_row)
+    return read_dataframe(path, start, end, return_first_row=return_first_row)
+
+
+def read_sensors(path):
+    '''Read the sensor readings logged alongside a track file (see
+    box/sensors.py) into a DataFrame indexed by sequence number, with
+    columns time, temp, and lux, so they can be joined to the track's
+    sensor_seq column.  Returns None if there are none.'''
+    import pandas
+    sensorfile = strip_suffix(str(path)) + SENSORS_SUFFIX
+    if not os.path.exists(sensorfile):
+        return None
+    return pandas.read_csv(sensorfile, header=None, names=['seq', 'time', 'temp', 'lux'], index_col=0)
+
+
+def to_csv(binpath, csvfile):
+    '''Write the track in binary track file binpath to csvfile (a text file
+    object), exactly as the CSV track would have been written.'''
+    records = read_records(binpath)
+    row_format = format_row if records.dtype == RECORD_DTYPE else _format_row_v1
+    for frametime, status, x, y, numpts, *sensor_data in records.tolist():
+        pos = (None, None) if math.isnan(x) else (x, y)
+        csvfile.write(row_format(frametime, STATUSES[status], pos, numpts, *sensor_data))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: %s FILE%s [...]" % (sys.argv[0], BIN_SUFFIX))
+        print("Converts binary track files into CSV track files alongside them.")
+        sys.exit(1)
+
+    for binpath in sys.argv[1:]:
+        if not is_binary(binpath):
+            print("Skipping %s: not a %s file." % (binpath, BIN_SUFFIX))
+            continue
+        csvpath = strip_suffix(binpath) + CSV_SUFFIX
+        with open(csvpath, 'w') as csvfile:
+            to_csv(binpath, csvfile)
+        print("%s -> %s" % (binpath, csvpath))
+
+
+if __name__ == '__main__':
+    main()
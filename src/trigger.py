@@ -0,0 +1,131 @@
+'''Trigger zones: the parts of the tank in which the fish triggers a stimulus.
+
+An experiment's trigger ([experiment] trigger in its ini file) is an
+expression over xpos and ypos, the fish's position in tank coordinates
+(0.0-1.0), e.g. "xpos < 0.50".  It may also use polygon(x1,y1, x2,y2, ...),
+true inside the given polygon, and any zones named in a [zones] section,
+each defined by an expression of the same form (and able to use the zones
+defined before it).  Combine conditions and zones with and, or, and not
+(or &, |, and ~):
+
+    [zones]
+    left = xpos < 0.50
+    corner = polygon(0.0,0.0, 0.3,0.0, 0.0,0.3)
+
+    [experiment]
+    trigger = left & ~corner
+
+(Zone names are not case-sensitive, as with any ini option.)
+
+TriggerGrid evaluates the trigger once, over a grid of points spaced
+1/RESOLUTION apart across the tank, and a position then takes the value of
+the nearest grid point at or below it in x and y: testing a position is a
+single array lookup.  Boundaries at multiples of 1/RESOLUTION (e.g. 0.50)
+fall exactly where the expression puts them, and positions recorded in a
+track file (rounded to 3 decimal places) lie on the grid points themselves.
+The box (box/experiment.py) and the analysis (analysis/process.py) both use
+a TriggerGrid, so they always agree on whether a position triggers.
+'''
+import ast
+import functools
+
+import numpy
+
+RESOLUTION = 1000
+
+# Nudge positions up by a tiny fraction of a grid step before finding their
+# grid point, so one that is a grid point, give or take floating point
+# error, is never taken for the point below it.
+_EPSILON = 1e-6
+
+
+def _inside_polygon(xpos, ypos, coords):
+    '''Return whether each point (xpos, ypos; arrays or scalars) is inside the
+    polygon with vertices coords (x1, y1, x2, y2, ...), by the even-odd rule.'''
+    if len(coords) < 6 or len(coords) % 2:
+        raise ValueError("polygon() needs x,y coordinates of at least 3 vertices.")
+    xs, ys = coords[0::2], coords[1::2]
+    inside = numpy.zeros(numpy.broadcast(xpos, ypos).shape, dtype=bool)
+    for i in range(len(xs)):
+        x1, y1 = xs[i-1], ys[i-1]
+        x2, y2 = xs[i], ys[i]
+        if y1 == y2:
+            continue  # a horizontal edge never crosses a horizontal ray
+        # does a ray from the point toward +x cross this edge?
+        crosses = ((y1 > ypos) != (y2 > ypos)) & (xpos < x1 + (ypos - y1) * (x2 - x1) / (y2 - y1))
+        inside ^= crosses
+    return inside
+
+
+class _ArrayLogic(ast.NodeTransformer):
+    '''Rewrites an expression's 'and', 'or', 'not', and chained comparisons
+    (e.g. "0.2 < xpos < 0.4") as the equivalent elementwise operations, so it
+    can be evaluated over whole arrays at once.'''
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        return functools.reduce(lambda left, right: ast.BinOp(left, op, right), node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(ast.Invert(), node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        operands = [node.left] + node.comparators
+        pairs = [ast.Compare(operands[i], [op], [operands[i+1]]) for i, op in enumerate(node.ops)]
+        return functools.reduce(lambda left, right: ast.BinOp(left, ast.BitAnd(), right), pairs)
+
+
+def _compile(expression):
+    tree = _ArrayLogic().visit(ast.parse(expression.strip(), mode='eval'))
+    return compile(ast.fix_missing_locations(tree), '<trigger>', 'eval')
+
+
+class TriggerGrid(object):
+    '''A trigger expression (and zones: a mapping of names to expressions, in
+    order), compiled into a grid.  See the module docstring.'''
+    def __init__(self, expression, zones=None, resolution=RESOLUTION):
+        self.expression = str(expression)
+        self._resolution = resolution
+        points = numpy.arange(resolution + 1) / resolution
+        # grid[j, i] is the trigger at xpos = points[i], ypos = points[j]
+        xpos, ypos = numpy.meshgrid(points, points)
+
+        names = {}
+        for name, zone_exp in (zones or {}).items():
+            names[name] = self._evaluate(str(zone_exp), xpos, ypos, names)
+        self.grid = self._evaluate(self.expression, xpos, ypos, names)
+
+    @staticmethod
+    def _evaluate(expression, xpos, ypos, names):
+        '''Evaluate expression at every grid point, returning a boolean grid.'''
+        def polygon(*coords):
+            return _inside_polygon(xpos, ypos, coords)
+
+        namespace = dict(names, xpos=xpos, ypos=ypos, polygon=polygon)
+        result = eval(_compile(expression), {}, namespace)
+        return numpy.broadcast_to(numpy.asarray(result, dtype=bool), xpos.shape)
+
+    def _indices(self, pos):
+        return numpy.clip(numpy.floor(numpy.asarray(pos) * self._resolution + _EPSILON), 0, self._resolution).astype(int)
+
+    def test(self, xpos, ypos):
+        '''Return whether the position (xpos, ypos) triggers.'''
+        i = min(max(int(xpos * self._resolution + _EPSILON), 0), self._resolution)
+        j = min(max(int(ypos * self._resolution + _EPSILON), 0), self._resolution)
+        return bool(self.grid[j, i])
+
+    def test_many(self, xpos, ypos):
+        '''Return a boolean array of whether each position (xpos, ypos:
+        arrays, or pandas Series) triggers.  Unknown (NaN) positions never
+        do.'''
+        xpos = numpy.asarray(xpos, dtype=float)
+        ypos = numpy.asarray(ypos, dtype=float)
+        known = ~(numpy.isnan(xpos) | numpy.isnan(ypos))
+        result = self.grid[self._indices(numpy.where(known, ypos, 0)), self._indices(numpy.where(known, xpos, 0))]
+        return result & known
@@ -13,11 +13,13 @@ from pathlib import Path
 import matplotlib
 matplotlib.use('Agg')
 
-from bottle import get, post, redirect, request, response, jinja2_template as template  # noqa: E402
+from bottle import abort, get, post, redirect, request, response, jinja2_template as template  # noqa: E402
 
 from analysis import heatmaps, process, plot  # noqa: E402
 from web.error_handlers import TrackParseError   # noqa: E402
 from common import mkdir  # noqa: E402
+from framebundle import FrameBundle, open_bundle  # noqa: E402
+import trackformat  # noqa: E402
 import config  # noqa: E402
 
 
@@ -78,6 +80,25 @@ def get_stats():
     return _make_stats_output(stats, all_keys, do_csv=request.query.csv)
 
 
+def _dbgframe_links(trackrel):
+    ''' Return (frame number, url) pairs for the debug frames of a track,
+        to link in its trace plot. '''
+    trackreldir = trackrel.parent
+    trackname = trackformat.strip_suffix(trackrel.name)
+    dbgframedir = config.DBGFRAMEDIR / trackreldir / trackname
+    dbgframes = []
+    if FrameBundle.exists(dbgframedir):
+        dbgframes += [(entry.frame_num, "/dbgframe/{}/{}/{}".format(trackreldir / trackname, entry.frame_num, entry.kind))
+                      for entry in open_bundle(dbgframedir).entries
+                      if entry.kind == 'subframe'
+                      ]
+    # debug frames saved as individual files by older versions
+    dbgframes += [(int(p.name.split('_')[1]), str("/data" / p.relative_to(config.DATADIR)))
+                  for p in dbgframedir.glob("subframe*.png")
+                  ]
+    return dbgframes
+
+
 def _do_analyze(trackrel):
     trackrel = Path(trackrel)
 
@@ -85,13 +106,8 @@ def _do_analyze(trackrel):
     trackreldir = trackrel.parent
     mkdir(config.PLOTDIR / trackreldir)
 
-    # look for debug frames to create links in the trace plot
-    trackname = trackrel.name.replace('-track.csv', '')
-    dbgframedir = config.DBGFRAMEDIR / trackreldir / trackname
-    dbgframes = list(dbgframedir.glob("subframe*.png"))  # list so TrackPlotter can re-use (instead of exhausting the iterable)
-
     processor = process.TrackProcessor(str(config.TRACKDIR / trackrel))
-    plotter = plot.TrackPlotter(processor, dbgframes)
+    plotter = plot.TrackPlotter(processor, _dbgframe_links(trackrel))
     plotter.plot_heatmap()
 
     def saveplot(filename):
@@ -109,6 +125,24 @@ def _do_analyze(trackrel):
     saveplot("{}.20.plot.svg".format(trackrel))
 
 
+@get('/trace/<trackrel:path>')
+def get_trace(trackrel):
+    ''' Plot the trace of minutes start to end (query parameters) of a track,
+        reading just those minutes of the track file if the track has an
+        index, so any part of a long track can be viewed quickly. '''
+    start_min = request.query.get('start', 0, type=int)
+    end_min = request.query.get('end', start_min + 1, type=int)
+    processor = process.TrackProcessor(str(config.TRACKDIR / trackrel), minutes=(start_min, end_min))
+    if processor.df.empty:
+        abort(404, "No track data in minutes {}-{}.".format(start_min, end_min))
+    plotter = plot.TrackPlotter(processor, _dbgframe_links(Path(trackrel)))
+    plotter.plot_trace()
+    output = io.BytesIO()
+    plot.savefig(output, format='svg')
+    response.content_type = 'image/svg+xml'
+    return output.getvalue()
+
+
 @post('/analyze/')
 def post_analyze():
     trackrel = request.query.trackrel
@@ -139,14 +173,13 @@ def post_analyze_selection():
 @get('/heatmaps/')
 def get_heatmaps():
     trackrels = request.query.tracks.split('|')
-    processors = []
+    trackfiles = [str(config.TRACKDIR / trackrel) for trackrel in trackrels]
     # to verify all phases are equivalent
     plength_map = defaultdict(list)
-    for trackrel in trackrels:
+    for trackrel, trackfile in zip(trackrels, trackfiles):
         try:
-            p = process.TrackProcessor(str(config.TRACKDIR / trackrel), just_raw_data=True)
-            processors.append(p)
-            plength_map[tuple(phase.length for phase in p.phase_list)].append(trackrel)
+            _, phase_list = process.read_setup(trackformat.strip_suffix(trackfile) + "-setup.txt")
+            plength_map[tuple(phase.length for phase in phase_list)].append(trackrel)
         except ValueError:
             raise(TrackParseError(trackrel, sys.exc_info()))
     if len(plength_map) > 1:
@@ -166,11 +199,30 @@ def get_heatmaps():
     # use phases from an arbitrary track
     plengths = plength_map.popitem()[0]
 
-    dataframes = [proc.df for proc in processors]
+    # Tracks with an index are read one phase at a time, so only that phase
+    # need be held in memory; those without one are read whole, just once.
+    whole_dfs = {}
+    for trackrel, trackfile in zip(trackrels, trackfiles):
+        if trackformat.read_index(trackfile) is None:
+            try:
+                whole_dfs[trackfile] = trackformat.read_dataframe(trackfile)
+            except ValueError:
+                raise(TrackParseError(trackrel, sys.exc_info()))
+
     phase_start = 0
     for i, length in enumerate(plengths):
         phase_end = phase_start + length
-        x, y = heatmaps.get_timeslice(dataframes, phase_start*60, phase_end*60)
+        dataframes = []
+        for trackrel, trackfile in zip(trackrels, trackfiles):
+            if trackfile in whole_dfs:
+                df = whole_dfs[trackfile]
+                dataframes.append(df[(df.index >= phase_start*60) & (df.index < phase_end*60)])
+                continue
+            try:
+                dataframes.append(trackformat.read_phase(trackfile, i+1, phase_start*60, phase_end*60))
+            except ValueError:
+                raise(TrackParseError(trackrel, sys.exc_info()))
+        x, y = heatmaps.get_timeslice(dataframes, None, None)
         title = "Phase {} ({}:00-{}:00)".format(i+1, phase_start, phase_end)
         ax = heatmaps.make_heatmap(x, y, title)
         plot.format_axis(ax)
@@ -2,6 +2,7 @@ import shutil
 from bottle import post, request
 
 import config
+import trackformat
 from common import mkdir
 
 
@@ -18,7 +19,7 @@ def _relative_move(srcroot, srcrel, destroot):
 
 
 def _get_relpaths(basepath, trackrel):
-    base_wildcard = trackrel.replace("-track.csv", "*")
+    base_wildcard = trackformat.strip_suffix(trackrel) + "*"
     paths = basepath.glob(base_wildcard)
     for path in paths:
         yield path.relative_to(basepath)
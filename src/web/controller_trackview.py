@@ -1,15 +1,20 @@
 import collections
 import datetime
+import math
 import numbers
 import statistics
 import tempfile
 import zipfile
+from pathlib import Path
 
-from bottle import request, response, route, jinja2_template as template
+from bottle import abort, request, response, route, jinja2_template as template
 from sqlalchemy import sql
 
 import config
+import trackformat
+from analysis import process
 import web.db_schema as db_schema
+from framebundle import FrameBundle, BUNDLE_NAME, INDEX_NAME, open_bundle
 
 
 def _imgs(trackrel):
@@ -20,15 +25,42 @@ def _imgs(trackrel):
 
 
 def _dbgframes(trackrel):
-    expname = trackrel.replace("-track.csv", "")
-    return [p.relative_to(config.BASEDIR)
-            for p in
-            sorted((config.DBGFRAMEDIR / expname).glob("*"))
-            ]
+    expname = trackformat.strip_suffix(trackrel)
+    dbgframedir = config.DBGFRAMEDIR / expname
+    frames = [p.relative_to(config.BASEDIR)
+              for p in
+              sorted(dbgframedir.glob("*"))
+              if p.name not in (BUNDLE_NAME, INDEX_NAME)
+              ]
+    if FrameBundle.exists(dbgframedir):
+        # frames in the bundle are served by debug_frame() below
+        frames += [Path("dbgframe", expname, str(entry.frame_num), entry.kind)
+                   for entry in open_bundle(dbgframedir).entries
+                   ]
+    return frames
+
+
+def _has_dbgframes(trackrel):
+    ''' Return whether a track has any debug frames, without reading them. '''
+    dbgframedir = config.DBGFRAMEDIR / trackformat.strip_suffix(trackrel)
+    return FrameBundle.exists(dbgframedir) or any(dbgframedir.glob("*"))
+
+
+def _trace_minutes(trackrel):
+    ''' Return the minutes of a track, each to be linked to its trace view:
+        those in its index, or else those in its phases. '''
+    index = trackformat.read_index(config.TRACKDIR / trackrel)
+    if index is not None:
+        return [minute for minute, _, _ in index['minute']]
+    _, phase_list = process.read_setup(str(config.TRACKDIR / trackformat.strip_suffix(trackrel)) + "-setup.txt")
+    total_minutes = sum(phase.length for phase in phase_list)
+    if not math.isfinite(total_minutes):
+        return []
+    return list(range(int(math.ceil(total_minutes))))
 
 
 def _setupfile(trackrel):
-    setupfile = trackrel.replace("-track.csv", "-setup.txt")
+    setupfile = trackformat.strip_suffix(trackrel) + "-setup.txt"
     if (config.TRACKDIR / setupfile).is_file():
         return setupfile
     else:
@@ -54,7 +86,7 @@ def _get_track_data(db, filters):
     for row in track_data:
         row['asml'] = [str(x) for x in (row[key] for key in ('acquired', 'sketchy', 'missing', 'lost'))]
         row['imgs'] = _imgs(row['trackrel'])
-        row['dbgframes'] = _dbgframes(row['trackrel'])
+        row['dbgframes'] = _has_dbgframes(row['trackrel'])
         row['setupfile'] = _setupfile(row['trackrel'])
 
     return track_data
@@ -178,7 +210,7 @@ def tracks(db):
 
 @route('/view/<trackrel:path>')
 def view_track(trackrel):
-    return template('view', imgs=_imgs(trackrel), trackrel=trackrel)
+    return template('view', imgs=_imgs(trackrel), trackrel=trackrel, trace_minutes=_trace_minutes(trackrel))
 
 
 @route('/dbgframes/<trackrel:path>')
@@ -186,6 +218,19 @@ def debug_frames(trackrel):
     return template('view', imgs=_dbgframes(trackrel), trackrel=trackrel)
 
 
+@route('/dbgframe/<expname:path>/<frame_num:int>/<kind>')
+def debug_frame(expname, frame_num, kind):
+    dbgframedir = config.DBGFRAMEDIR / expname
+    if not FrameBundle.exists(dbgframedir):
+        abort(404, "No debug frames found for %s." % expname)
+    try:
+        jpeg = open_bundle(dbgframedir).get_jpeg(frame_num, kind)
+    except KeyError:
+        abort(404, "Debug frame %d (%s) not found for %s." % (frame_num, kind, expname))
+    response.set_header('Content-Type', 'image/jpeg')
+    return jpeg
+
+
 @route('/download/')
 def download():
     trackrels = request.query.tracks.split('|')
@@ -194,7 +239,7 @@ def download():
     temp = tempfile.SpooledTemporaryFile()
     with zipfile.ZipFile(temp, 'w', zipfile.ZIP_DEFLATED) as archive:
         for trackrel in trackrels:
-            base_wildcard = trackrel.replace("-track.csv", "*")
+            base_wildcard = trackformat.strip_suffix(trackrel) + "*"
             paths = config.TRACKDIR.glob(base_wildcard)
             for path in paths:
                 archive.write(str(path),
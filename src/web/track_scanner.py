@@ -4,24 +4,31 @@ import dateutil
 import re
 import time
 
+import numpy
 from sqlalchemy import sql
 
 import config
+import trackformat
 from common import Phase, get_boxname # noqa
 import web.db_schema as db_schema
 
 
-_trackfile_parse_regexp = re.compile(r"(\d{8}-\d{4,6})-?(.*)-track.csv")
+_trackfile_parse_regexp = re.compile(r"(\d{8}-\d{4,6})-?(.*)-track\.(?:csv|bin)")
+
+# configuration: # buckets for x/y in heatmaps
+_xbuckets = 30
+_ybuckets = 15
 
 
 def _track_files_set():
-    return set(config.TRACKDIR.glob("**/*-track.csv"))
+    return set(config.TRACKDIR.glob("**/*-track.csv")) | set(config.TRACKDIR.glob("**/*-track.bin"))
 
 
-def _get_track_data(track):
-    # configuration: # buckets for x/y in heatmaps
-    xbuckets = 30
-    ybuckets = 15
+def _count_csv_track(track):
+    '''Return the number of rows in a CSV track, counts of each state, and
+    heatmaps of valid and invalid positions (as Counters).'''
+    xbuckets = _xbuckets
+    ybuckets = _ybuckets
 
     states = collections.Counter()
     heatmap = collections.Counter()
@@ -59,6 +66,48 @@ def _get_track_data(track):
             if state == "init":
                 state = "lost"
 
+    return lines, states, heatmap, invalid_heatmap
+
+
+def _bucket_counts(x, y):
+    '''Count positions (arrays of x and y) in heatmap buckets.'''
+    buckets = numpy.stack([(x * _xbuckets).astype(int), (y * _ybuckets).astype(int)], axis=1)
+    if not len(buckets):
+        return collections.Counter()
+    buckets, counts = numpy.unique(buckets, axis=0, return_counts=True)
+    return collections.Counter({tuple(bucket): count for bucket, count in zip(buckets.tolist(), counts.tolist())})
+
+
+def _count_binary_track(track):
+    '''As _count_csv_track(), for a binary track, using array operations on
+    the mapped records rather than parsing each row.'''
+    records = trackformat.read_records(track)
+    status = numpy.array(trackformat.STATUSES)[records['status']]
+    # multiple detections make any status "sketchy"
+    status[records['numpts'] > 1] = "sketchy"
+    names, counts = numpy.unique(status, return_counts=True)
+    states = collections.Counter(dict(zip(names.tolist(), counts.tolist())))
+
+    x = records['x']
+    y = records['y']
+    known = ~numpy.isnan(x)
+    valid = known & numpy.isin(status, ['acquired', 'sketchy'])
+    invalid = known & numpy.isin(status, ['missing', 'lost'])
+    heatmap = _bucket_counts(x[valid], y[valid])
+    invalid_heatmap = _bucket_counts(x[invalid], y[invalid])
+
+    return len(records), states, heatmap, invalid_heatmap
+
+
+def _get_track_data(track):
+    xbuckets = _xbuckets
+    ybuckets = _ybuckets
+
+    if trackformat.is_binary(track):
+        lines, states, heatmap, invalid_heatmap = _count_binary_track(track)
+    else:
+        lines, states, heatmap, invalid_heatmap = _count_csv_track(track)
+
     if lines:
         asml = ["%0.3f" % (states[key] / float(lines)) for key in ('acquired', 'sketchy', 'missing', 'lost')]
     else:
@@ -107,7 +156,7 @@ def _get_track_db_info(key, trackfile, trackrelpath):
     starttime_str, exp_name = _trackfile_parse_regexp.search(filename).groups()
     starttime = dateutil.parser.parse(starttime_str)
 
-    setupfile = trackfile.with_name(trackfile.name.replace('-track.csv', '-setup.txt'))
+    setupfile = trackfile.with_name(trackformat.strip_suffix(trackfile.name) + '-setup.txt')
     if setupfile.is_file():
         notes, trigger, controller, stimulus, did_stim, phase_data = _get_setup_info(setupfile)
     else: